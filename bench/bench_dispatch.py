@@ -0,0 +1,75 @@
+"""
+Per-message routing cost: the prefix dispatcher vs. one regex per handler.
+
+    python bench/bench_dispatch.py
+"""
+import random
+import timeit
+
+import _bootstrap  # noqa: F401
+import main
+
+MESSAGES = 100000
+
+def build_messages():
+    chatter = [
+        "bhai price koto?",
+        "ok done",
+        "Send money kore dilam, last 3 digit 371",
+        "1710824990",
+        "😂😂",
+        "...",
+        ".",
+        "https://t.me/some_channel/123",
+        "diamond top up lagbe 520",
+    ]
+    commands = [
+        ".Cid 1710824990",
+        ".ps 1710824990 CAREER br",
+        ".ps 1710824990 ALL",
+        ".c 100+10%",
+        ".ping",
+        ".help",
+        ".pay",
+    ]
+    rng = random.Random(42)
+    # Busy group: roughly one message in ten is a command
+    return [rng.choice(commands) if rng.random() < 0.1 else rng.choice(chatter) for _ in range(MESSAGES)]
+
+def legacy_route(patterns, text):
+    # Old layout: Telethon ran every handler's pattern on every message
+    found = None
+    for pattern in patterns:
+        match = pattern.match(text)
+        if match and found is None:
+            found = match
+    return found
+
+def dispatcher_route(text):
+    if not text or text[0] != ".":
+        return None
+    found = main.find_routes(text)
+    if found is None:
+        return None
+    return main.match_route(found[1], text)
+
+def main_bench():
+    messages = build_messages()
+    patterns = [route[0] for routes in main.COMMANDS.values() for route in routes]
+    
+    def run_legacy():
+        for text in messages:
+            legacy_route(patterns, text)
+    
+    def run_dispatcher():
+        for text in messages:
+            dispatcher_route(text)
+    
+    for name, func in (("one regex per handler", run_legacy), ("prefix dispatcher", run_dispatcher)):
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print("{:<22} {:>8.0f} ns/message  ({} patterns)".format(
+            name, best / MESSAGES * 1e9, len(patterns) if func is run_legacy else "1-3"
+        ))
+
+if __name__ == "__main__":
+    main_bench()
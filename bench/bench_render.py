@@ -0,0 +1,91 @@
+"""
+Report rendering cost: the old hand-written formatters vs. the compiled
+schema renderers, and the render cache in front of them.
+
+    python bench/bench_render.py
+"""
+import itertools
+import timeit
+
+import _bootstrap  # noqa: F401
+import legacy_format
+import main
+
+ROUNDS = 20000
+
+def detailed(**stats):
+    return stats
+
+CS = {"success": True, "metadata": {"server": "bd"}, "data": {"csstats": {
+    "gamesplayed": 500, "kills": 1500, "wins": 260, "detailedstats": detailed(
+        deaths=700, headshotkills=600, damage=300000, knockdowns=1800, assists=400, revivals=100,
+        mvpcount=80, doublekills=200, triplekills=50, fourkills=5, ratingpoints=1234.5678,
+        ratingenabledgames=300, streakwins=7, onegamemostkills=12, onegamemostdamage=4500,
+        headshotcount=2000, hitcount=9000, throwingkills=11)},
+}}
+PROFILE = {
+    "basicinfo": {
+        "nickname": "Tester", "accountid": "1710824990", "region": "BD", "accounttype": 1, "level": 70,
+        "exp": 3000000, "liked": 12345, "createat": "1600000000", "lastloginat": "1700000000", "rank": 321,
+        "rankingpoints": 4567, "maxrank": 322, "csrank": 320, "csrankingpoints": 88, "hipporank": 5,
+        "veteranexpiretime": "1800000000",
+    },
+    "petinfo": {"name": "Dog", "id": 1, "level": 5, "exp": 1000, "skinid": 9, "selectedskillid": 7},
+    "socialinfo": {"signature": "hi"},
+    "creditscoreinfo": {"creditscore": 100},
+}
+
+# More distinct login times than the date memo holds
+NEW_LOGINS = [
+    dict(PROFILE, basicinfo=dict(PROFILE["basicinfo"], lastloginat=str(1700000000 + minute * 60)))
+    for minute in range(10000)
+]
+
+CS_EMPTY = {"data": {}}
+PROFILE_SPARSE = {"basicinfo": {"region": "SG"}}
+OPTIONS = {"uid": "1710824990", "matchmode": "CAREER"}
+RANKED = {"uid": "1710824990", "matchmode": "RANKED"}
+
+# (name, payloads cycled through, old formatter, compiled renderer, public formatter - render cache in front)
+CASES = [
+    ("CS stats (ranked)", [CS],
+     lambda data: legacy_format.format_cs_stats(data, "RANKED", "1710824990"),
+     lambda data: main.render_cs_stats(data, RANKED),
+     lambda data: main.format_cs_stats(data, "RANKED", "1710824990")),
+    ("CS stats (empty)", [CS_EMPTY],
+     lambda data: legacy_format.format_cs_stats(data, "CAREER", "1710824990"),
+     lambda data: main.render_cs_stats(data, OPTIONS),
+     lambda data: main.format_cs_stats(data, "CAREER", "1710824990")),
+    ("Profile", [PROFILE],
+     legacy_format.format_player_profile,
+     lambda data: main.render_player_profile(data, {}),
+     main.format_player_profile),
+    # The login time changes between lookups of a player: it misses the date memo (and the render cache)
+    ("Profile (new login)", NEW_LOGINS,
+     legacy_format.format_player_profile,
+     lambda data: main.render_player_profile(data, {}),
+     main.format_player_profile),
+    ("Profile (sparse)", [PROFILE_SPARSE],
+     legacy_format.format_player_profile,
+     lambda data: main.render_player_profile(data, {}),
+     main.format_player_profile),
+]
+
+def per_call(func, payloads):
+    cycle = itertools.cycle(payloads)
+    return min(timeit.repeat(lambda: func(next(cycle)), number=ROUNDS, repeat=5)) / ROUNDS * 1e6
+
+def main_bench():
+    for name, payloads, legacy, compiled, cached in CASES:
+        for data in payloads[:3]:
+            expected = legacy(data)
+            if compiled(data) != expected or cached(data) != expected or cached(data) != expected:
+                raise SystemExit("{}: compiled output differs from the legacy formatter".format(name))
+        
+        legacy_us, compiled_us, cached_us = (per_call(func, payloads) for func in (legacy, compiled, cached))
+        print("{:<20} legacy {:>6.1f} µs | compiled {:>6.1f} µs ({:.2f}x) | via render cache {:>5.1f} µs ({:.0f}x)".format(
+            name, legacy_us, compiled_us, legacy_us / compiled_us, cached_us, legacy_us / cached_us
+        ))
+
+if __name__ == "__main__":
+    main_bench()
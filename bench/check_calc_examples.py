@@ -0,0 +1,26 @@
+"""
+Run every .c help example (CALC_EXAMPLES) through the calculator engine
+and compare with the result the help text promises.
+
+    python bench/check_calc_examples.py
+"""
+import sys
+
+import _bootstrap  # noqa: F401
+import main
+
+def main_check():
+    failures = 0
+    for expression, expected in main.CALC_EXAMPLES:
+        try:
+            actual = main.format_calc_result(main.evaluate_expression(main.parse_expression(expression)))
+        except Exception as e:
+            actual = "{}: {}".format(type(e).__name__, e)
+        ok = actual == expected
+        failures += not ok
+        print("{:<4} .c {:<15}→ {:<10} (expected {})".format("ok" if ok else "FAIL", expression, actual, expected))
+    print("{} of {} examples match".format(len(main.CALC_EXAMPLES) - failures, len(main.CALC_EXAMPLES)))
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main_check())
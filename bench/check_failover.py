@@ -0,0 +1,68 @@
+"""
+Check that api_get fails over from a dead primary to a live secondary,
+with and without UPSTREAM_HEDGE, before and after the primary has enough
+latency samples to hedge.
+
+    python bench/check_failover.py
+"""
+import asyncio
+import socket
+import sys
+
+from aiohttp import web
+
+import _bootstrap  # noqa: F401
+import main
+
+PAYLOAD = {"basicinfo": {"nickname": "failover"}}
+
+async def profile(request):
+    return web.json_response(PAYLOAD)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def run_checks():
+    app = web.Application()
+    app.router.add_get("/get_player_personal_show", profile)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    live_port, dead_port = free_port(), free_port()
+    await web.TCPSite(runner, "127.0.0.1", live_port).start()
+
+    cases = [
+        ("hedging off", False, 0),
+        ("hedging on, no latency samples", True, 0),
+        ("hedging on, primary fails before the hedge delay", True, main.CircuitBreaker.MIN_SAMPLES),
+    ]
+    failures = 0
+    try:
+        for name, hedge, samples in cases:
+            dead = main.Upstream("http://127.0.0.1:{}".format(dead_port))
+            live = main.Upstream("http://127.0.0.1:{}".format(live_port))
+            # Same history on both, so the dead endpoint is still ranked first
+            for upstream in (dead, live):
+                for _ in range(samples):
+                    upstream.breakers["profile"].observe_latency(1.0)
+            main.upstream_pool[:] = [dead, live]
+            main.UPSTREAM_HEDGE = hedge
+            try:
+                actual = await main.api_get("profile", "/get_player_personal_show?server=bd&uid=1")
+            except Exception as e:
+                actual = "{}: {}".format(type(e).__name__, e)
+            ok = actual == PAYLOAD
+            failures += not ok
+            print("{:<4} {:<50} → {}".format("ok" if ok else "FAIL", name, actual))
+    finally:
+        await main.close_http_session()
+        await runner.cleanup()
+    return failures
+
+def main_check():
+    failures = asyncio.run(run_checks())
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main_check())
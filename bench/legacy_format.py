@@ -0,0 +1,203 @@
+"""
+The hand-written formatters as they were before the report schema. Kept
+only so bench_render.py can time them and check the compiled renderers
+produce the same text.
+"""
+import logging
+
+from main import (
+    calculate_headshot_rate,
+    calculate_kd,
+    calculate_winrate,
+    format_number,
+    get_rank_tier,
+    unix_to_date,
+)
+
+def format_cs_stats(data, matchmode, uid):
+    """Format Clash Squad stats beautifully"""
+    try:
+        stats_data = data.get("data", {})
+        metadata = data.get("metadata", {})
+        
+        cs = stats_data.get("csstats", {})
+        cs_detailed = cs.get("detailedstats", {})
+        
+        lines = []
+        lines.append("```")
+        lines.append("⚔️ FREE FIRE CLASH SQUAD STATS")
+        lines.append("═════════════════════════════════════")
+        lines.append("")
+        lines.append("🆔 Player ID: {}".format(uid))
+        lines.append("📊 Match Mode: {}".format(matchmode.upper()))
+        lines.append("🎯 Game Mode: Clash Squad")
+        lines.append("🌍 Server: {}".format(metadata.get("server", "BD").upper()))
+        lines.append("")
+        
+        if cs.get("gamesplayed") or cs.get("kills") or cs.get("wins"):
+            games = cs.get("gamesplayed", 0)
+            kills = cs.get("kills", 0)
+            wins = cs.get("wins", 0)
+            deaths = cs_detailed.get("deaths", 0)
+            hs_kills = cs_detailed.get("headshotkills", 0)
+            
+            lines.append("📊 GENERAL STATISTICS")
+            lines.append("─────────────────────────────────────")
+            lines.append("🎮 Games Played: {}".format(format_number(games)))
+            lines.append("🏆 Wins: {} ({})".format(format_number(wins), calculate_winrate(wins, games)))
+            lines.append("💀 Kills: {}".format(format_number(kills)))
+            lines.append("☠️ Deaths: {}".format(format_number(deaths)))
+            lines.append("📈 K/D Ratio: {}".format(calculate_kd(kills, deaths)))
+            lines.append("🎯 Headshot Kills: {} ({})".format(format_number(hs_kills), calculate_headshot_rate(hs_kills, kills)))
+            lines.append("💥 Damage: {}".format(format_number(cs_detailed.get("damage", 0))))
+            lines.append("👊 Knockdowns: {}".format(format_number(cs_detailed.get("knockdowns", 0))))
+            lines.append("🤝 Assists: {}".format(format_number(cs_detailed.get("assists", 0))))
+            lines.append("💉 Revivals: {}".format(format_number(cs_detailed.get("revivals", 0))))
+            lines.append("⭐ MVP Count: {}".format(format_number(cs_detailed.get("mvpcount", 0))))
+            lines.append("")
+            
+            lines.append("🔥 MULTI-KILL STATISTICS")
+            lines.append("─────────────────────────────────────")
+            lines.append("2️⃣ Double Kills: {}".format(format_number(cs_detailed.get("doublekills", 0))))
+            lines.append("3️⃣ Triple Kills: {}".format(format_number(cs_detailed.get("triplekills", 0))))
+            lines.append("4️⃣ Quadra Kills: {}".format(format_number(cs_detailed.get("fourkills", 0))))
+            
+            # Additional stats for ranked mode
+            if matchmode.upper() == "RANKED":
+                lines.append("")
+                lines.append("🏅 RANKED STATISTICS")
+                lines.append("─────────────────────────────────────")
+                if cs_detailed.get("ratingpoints"):
+                    lines.append("⭐ Rating Points: {:.2f}".format(cs_detailed.get("ratingpoints", 0)))
+                if cs_detailed.get("ratingenabledgames"):
+                    lines.append("🎮 Ranked Games: {}".format(cs_detailed.get("ratingenabledgames", 0)))
+                if cs_detailed.get("streakwins"):
+                    lines.append("🔥 Win Streak: {}".format(cs_detailed.get("streakwins", 0)))
+                if cs_detailed.get("onegamemostkills"):
+                    lines.append("🔫 Best Kills (1 Game): {}".format(cs_detailed.get("onegamemostkills", 0)))
+                if cs_detailed.get("onegamemostdamage"):
+                    lines.append("💥 Best Damage (1 Game): {}".format(format_number(cs_detailed.get("onegamemostdamage", 0))))
+                if cs_detailed.get("headshotcount"):
+                    lines.append("🎯 Total Headshots: {}".format(format_number(cs_detailed.get("headshotcount", 0))))
+                if cs_detailed.get("hitcount"):
+                    lines.append("🔫 Total Hits: {}".format(format_number(cs_detailed.get("hitcount", 0))))
+                if cs_detailed.get("throwingkills"):
+                    lines.append("💣 Grenade Kills: {}".format(cs_detailed.get("throwingkills", 0)))
+        else:
+            lines.append("❌ No Clash Squad stats available")
+        
+        lines.append("")
+        lines.append("═════════════════════════════════════")
+        lines.append("```")
+        return "\n".join(lines)
+        
+    except Exception as e:
+        logging.error("CS Stats Format Error: {}".format(e))
+        return "```\n❌ Error formatting CS stats: {}\n```".format(str(e))
+
+def format_player_profile(data):
+    try:
+        basic = data.get("basicinfo", {})
+        pet = data.get("petinfo", {})
+        social = data.get("socialinfo", {})
+        credit = data.get("creditscoreinfo", {})
+        
+        nickname = basic.get("nickname", "N/A")
+        player_id = basic.get("accountid", "N/A")
+        region = basic.get("region", "N/A")
+        account_type = basic.get("accounttype", "N/A")
+        level = basic.get("level", "N/A")
+        exp = format_number(basic.get("exp", 0))
+        likes = format_number(basic.get("liked", 0))
+        created_at = unix_to_date(basic.get("createat", "N/A"))
+        last_login = unix_to_date(basic.get("lastloginat", "N/A"))
+        
+        br_rank = basic.get("rank", "N/A")
+        rank_points = format_number(basic.get("rankingpoints", 0))
+        max_rank = basic.get("maxrank", "N/A")
+        cs_rank = basic.get("csrank", "N/A")
+        cs_points = basic.get("csrankingpoints", 0)
+        hippo_rank = basic.get("hipporank", "N/A")
+        
+        if br_rank != "N/A":
+            rank_tier = get_rank_tier(int(br_rank))
+        else:
+            rank_tier = "N/A"
+        
+        pet_name = pet.get("name", "N/A")
+        pet_id = pet.get("id", "N/A")
+        pet_level = pet.get("level", "N/A")
+        pet_exp = format_number(pet.get("exp", 0))
+        pet_skin = pet.get("skinid", "N/A")
+        pet_skill = pet.get("selectedskillid", "N/A")
+        
+        signature = social.get("signature", "N/A")
+        
+        veteran_expire = basic.get("veteranexpiretime", "")
+        if veteran_expire:
+            veteran_date = unix_to_date(veteran_expire)
+        else:
+            veteran_date = "N/A"
+        
+        credit_score = credit.get("creditscore", "N/A")
+        
+        if region == "BD":
+            region_display = "🇧🇩 Bangladesh"
+        else:
+            region_display = "🌍 " + str(region)
+        
+        if account_type == 1:
+            acc_type = "Garena (1)"
+        else:
+            acc_type = "Guest (" + str(account_type) + ")"
+        
+        lines = []
+        lines.append("```")
+        lines.append("🎮 Free Fire Player Profile")
+        lines.append("═══════════════════════════════")
+        lines.append("")
+        lines.append("👤 Nickname: " + str(nickname))
+        lines.append("🆔 Player ID: " + str(player_id))
+        lines.append("🌍 Region: " + region_display)
+        lines.append("🧾 Account Type: " + acc_type)
+        lines.append("🏅 Level: " + str(level))
+        lines.append("✨ EXP: " + str(exp))
+        lines.append("❤️ Likes: " + str(likes))
+        lines.append("📅 Created On: 🗓️ " + str(created_at))
+        lines.append("🔑 Last Login: ⏱️ " + str(last_login))
+        lines.append("")
+        lines.append("🏆 Rank Information")
+        lines.append("═══════════════════════════════")
+        lines.append("🎯 Battle Royale Rank: " + str(br_rank) + " 🏵️ (" + rank_tier + ")")
+        lines.append("⭐ Ranking Points: " + str(rank_points))
+        lines.append("🚀 Max Rank: " + str(max_rank))
+        lines.append("⚔️ Clash Squad Rank: " + str(cs_rank))
+        lines.append("🎯 CS Points: " + str(cs_points))
+        lines.append("🦈 Hippo Rank: " + str(hippo_rank))
+        lines.append("")
+        lines.append("🐾 Pet Information")
+        lines.append("═══════════════════════════════")
+        lines.append("🐶 Pet Name: " + str(pet_name))
+        lines.append("🆔 Pet ID: " + str(pet_id))
+        lines.append("📈 Level: " + str(pet_level) + " — EXP: " + str(pet_exp))
+        lines.append("🎨 Skin ID: " + str(pet_skin))
+        lines.append("💥 Selected Skill ID: " + str(pet_skill))
+        lines.append("")
+        lines.append("✍️ Social Information")
+        lines.append("═══════════════════════════════")
+        lines.append("💬 Signature: \"" + str(signature) + "\"")
+        lines.append("")
+        lines.append("🛡️ Veteran Status")
+        lines.append("═══════════════════════════════")
+        lines.append("🎖️ Expires: 🗓️ " + str(veteran_date))
+        lines.append("")
+        lines.append("⭐ Credit Score")
+        lines.append("═══════════════════════════════")
+        lines.append("🏅 Score: " + str(credit_score) + "/100")
+        lines.append("```")
+        
+        return "\n".join(lines)
+        
+    except Exception as e:
+        logging.error("Format Error: {}".format(e))
+        return "```\nError formatting data: {}\n```".format(str(e))
@@ -5,12 +5,25 @@ import asyncio
 import logging
 import random
 import string
+import time
+import json
+import zlib
+import hashlib
+import heapq
+import bisect
+import itertools
+import functools
+import sqlite3
+import threading
+import traceback
+from collections import OrderedDict, namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from flask import Flask
-from threading import Thread
 from telethon import TelegramClient, events, Button
 from telethon.sessions import StringSession
-import requests
+from telethon.errors import FloodWaitError, MessageNotModifiedError
+import aiohttp
+from aiohttp import web
 import re
 
 # Configure encoding
@@ -31,23 +44,106 @@ SESSION_STRING = os.environ.get("SESSION_STRING", "")
 # New environment variables for authorization and chat IDs
 AUTHORIZED_USERS = os.environ.get("AUTHORIZED_USERS", "")  # Comma-separated user IDs
 AUTHORIZED_GROUPS = os.environ.get("AUTHORIZED_GROUPS", "")  # Comma-separated group chat IDs
+ACL_FILE = os.environ.get("ACL_FILE", "")  # Optional JSON {"users": [...], "groups": [...]}; overrides the two above
 
 # Parse authorized users
-authorized_user_ids = []
+authorized_user_ids = frozenset()
 if AUTHORIZED_USERS:
     try:
-        authorized_user_ids = [int(uid.strip()) for uid in AUTHORIZED_USERS.split(",") if uid.strip()]
+        authorized_user_ids = frozenset(int(uid.strip()) for uid in AUTHORIZED_USERS.split(",") if uid.strip())
     except:
         logging.warning("Error parsing AUTHORIZED_USERS")
 
 # Parse authorized groups
-authorized_group_ids = []
+authorized_group_ids = frozenset()
 if AUTHORIZED_GROUPS:
     try:
-        authorized_group_ids = [int(gid.strip()) for gid in AUTHORIZED_GROUPS.split(",") if gid.strip()]
+        authorized_group_ids = frozenset(int(gid.strip()) for gid in AUTHORIZED_GROUPS.split(",") if gid.strip())
     except:
         logging.warning("Error parsing AUTHORIZED_GROUPS")
 
+# Upstream Free Fire API settings
+# Comma-separated base URLs (mirrors / self-hosted copies); the healthiest one is used per request
+API_BASE_URLS = [
+    url.strip().rstrip("/")
+    for url in os.environ.get("FF_API_URLS", "https://freefire-api-hkqw.onrender.com").split(",")
+    if url.strip()
+]
+UPSTREAM_HEDGE = os.environ.get("UPSTREAM_HEDGE", "0") == "1"  # Race a second endpoint when the first is slower than its p95
+FANOUT_CONCURRENCY = int(os.environ.get("FANOUT_CONCURRENCY", "7"))  # Parallel upstream calls per multi-lookup command
+
+# Speculative stats prefetch after .Cid ("MATCHMODE:gamemode" pairs; empty disables)
+PREFETCH_STATS = [
+    tuple(pair.strip().split(":", 1))
+    for pair in os.environ.get("PREFETCH_STATS", "CAREER:br,RANKED:cs").split(",")
+    if ":" in pair
+]
+PREFETCH_BUDGET_PER_MINUTE = int(os.environ.get("PREFETCH_BUDGET_PER_MINUTE", "30"))
+
+# Rate limiting for upstream-backed commands (.Cid, .ps): sustained rate per minute and burst size
+RATE_LIMIT_USER_PER_MIN = float(os.environ.get("RATE_LIMIT_USER_PER_MIN", "12"))
+RATE_LIMIT_USER_BURST = int(os.environ.get("RATE_LIMIT_USER_BURST", "4"))
+RATE_LIMIT_CHAT_PER_MIN = float(os.environ.get("RATE_LIMIT_CHAT_PER_MIN", "30"))
+RATE_LIMIT_CHAT_BURST = int(os.environ.get("RATE_LIMIT_CHAT_BURST", "8"))
+RATE_LIMIT_GLOBAL_PER_MIN = float(os.environ.get("RATE_LIMIT_GLOBAL_PER_MIN", "60"))
+RATE_LIMIT_GLOBAL_BURST = int(os.environ.get("RATE_LIMIT_GLOBAL_BURST", "15"))
+RATE_LIMIT_QUEUE_PER_CHAT = int(os.environ.get("RATE_LIMIT_QUEUE_PER_CHAT", "5"))  # Waiting commands per chat before "slow down"
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", "20"))  # Seconds a queued command may wait
+
+# Outbound message pacing (sends + edits per chat)
+OUTBOUND_PRIVATE_PER_MIN = float(os.environ.get("OUTBOUND_PRIVATE_PER_MIN", "60"))
+OUTBOUND_GROUP_PER_MIN = float(os.environ.get("OUTBOUND_GROUP_PER_MIN", "20"))
+OUTBOUND_BURST = int(os.environ.get("OUTBOUND_BURST", "3"))
+OUTBOUND_MAX_FLOOD_WAIT = int(os.environ.get("OUTBOUND_MAX_FLOOD_WAIT", "120"))  # Longer FloodWaits fail the message instead
+
+# Batch .Cid settings
+CID_BATCH_MAX = int(os.environ.get("CID_BATCH_MAX", "100"))  # Max UIDs per message
+CID_BATCH_CONCURRENCY = int(os.environ.get("CID_BATCH_CONCURRENCY", "5"))
+CID_BATCH_PAGE_SIZE = 40  # Result lines per Telegram message (stays well under 4096 chars)
+CID_BATCH_EDIT_INTERVAL = 2.0  # Seconds between progress edits
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.5"))  # Min seconds between progressive edits of one reply
+
+# Upstream job scheduler
+UPSTREAM_WORKERS = int(os.environ.get("UPSTREAM_WORKERS", "6"))  # Upstream lookups running at once
+UPSTREAM_QUEUE_MAX = int(os.environ.get("UPSTREAM_QUEUE_MAX", "200"))  # Queued lookups before new ones are refused
+UPSTREAM_JOB_DEADLINE = float(os.environ.get("UPSTREAM_JOB_DEADLINE", "45"))  # Seconds from queueing to giving up
+
+# Valid .ps arguments
+STATS_MATCHMODES = ["CAREER", "RANKED", "NORMAL"]
+STATS_GAMEMODES = ["br", "cs"]
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", "20"))  # Max open connections in total
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", "10"))  # Max open connections per upstream host
+
+# Upstream resilience settings
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))  # Consecutive failures before opening
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", "30"))  # Seconds open before a half-open probe
+UPSTREAM_MIN_TIMEOUT = float(os.environ.get("UPSTREAM_MIN_TIMEOUT", "3"))
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", "2"))  # Extra attempts on 5xx / connection resets
+UPSTREAM_RETRY_BASE_DELAY = float(os.environ.get("UPSTREAM_RETRY_BASE_DELAY", "0.25"))
+
+# Response cache settings (TTLs in seconds)
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "1000"))
+RENDER_CACHE_MAX_ENTRIES = int(os.environ.get("RENDER_CACHE_MAX_ENTRIES", "500"))  # Finished messages kept for identical payloads
+PROFILE_CACHE_TTL = int(os.environ.get("PROFILE_CACHE_TTL", "300"))
+STATS_CACHE_TTLS = {
+    "CAREER": int(os.environ.get("CAREER_CACHE_TTL", "1800")),
+    "RANKED": int(os.environ.get("RANKED_CACHE_TTL", "600")),
+    "NORMAL": int(os.environ.get("NORMAL_CACHE_TTL", "900")),
+}
+NEGATIVE_CACHE_TTL = int(os.environ.get("NEGATIVE_CACHE_TTL", "60"))  # "Player not found" and API failures
+STALE_WHILE_REVALIDATE = int(os.environ.get("STALE_WHILE_REVALIDATE", "3600"))  # Past TTL: reply from cache, refresh in background
+STALE_IF_ERROR = int(os.environ.get("STALE_IF_ERROR", "86400"))  # Past TTL: still used when the API fails
+
+# Event-loop watchdog: a thread captures the loop's stack when it stalls this long
+LAG_WATCHDOG_THRESHOLD = float(os.environ.get("LAG_WATCHDOG_THRESHOLD", "1.0"))
+LAG_HISTORY = int(os.environ.get("LAG_HISTORY", "20"))  # Stalls kept for .lag
+ASYNCIO_DEBUG = os.environ.get("ASYNCIO_DEBUG", "0") == "1"  # Also log each callback slower than LAG_SLOW_CALLBACK (slower loop)
+LAG_SLOW_CALLBACK = float(os.environ.get("LAG_SLOW_CALLBACK", "0.1"))
+
+# Persistent on-disk cache settings
+PLAYER_CACHE_PATH = os.environ.get("PLAYER_CACHE_PATH", "player_cache.db")  # Empty string disables it
+PLAYER_CACHE_MAX_ROWS = int(os.environ.get("PLAYER_CACHE_MAX_ROWS", "20000"))  # Approximate: rows another process adds are only seen on the next open
+
 # Validate environment variables
 if not API_ID or API_ID == 0:
     logging.error("API_ID is not set! Please set it in environment variables.")
@@ -62,25 +158,14 @@ if not SESSION_STRING:
     sys.exit(1)
 
 # Initialize Telethon with StringSession
-client = TelegramClient(StringSession(SESSION_STRING), API_ID, API_HASH)
+# flood_sleep_threshold=0: Telethon would otherwise sleep inline on any FloodWait
+# up to 60s; raising it instead lets the outbound scheduler defer the chat
+client = TelegramClient(StringSession(SESSION_STRING), API_ID, API_HASH, flood_sleep_threshold=0)
 
 # Global variable to cache owner ID (FIX #1)
 OWNER_ID = None
-
-# Flask app
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return "Free Fire Userbot is running!"
-
-@app.route('/health')
-def health():
-    return {"status": "alive", "bot": "running"}
-
-def run_flask():
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
+# Set at startup; inline buttons only work when logged in as a bot account
+BOT_ACCOUNT = False
 
 def unix_to_date(timestamp):
     try:
@@ -135,28 +220,1073 @@ def get_rank_tier(rank):
     else:
         return "Silver/Bronze"
 
-def fetch_player_data(uid, server="bd"):
-    try:
-        url = "https://freefire-api-hkqw.onrender.com/get_player_personal_show?server={}&uid={}".format(server, uid)
-        response = requests.get(url, timeout=10)
+# ================ ASYNC HTTP CLIENT ================
+
+# Shared aiohttp session (created lazily inside the running event loop)
+http_session = None
+
+def get_http_session():
+    """Return the shared upstream HTTP session, creating it on first use"""
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        http_session = aiohttp.ClientSession(connector=connector)
+    return http_session
+
+async def close_http_session():
+    """Close the shared upstream HTTP session"""
+    global http_session
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
+async def fetch_json(url, timeout):
+    """GET a URL through the shared pool and decode the JSON body"""
+    session = get_http_session()
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
         response.raise_for_status()
-        return response.json()
+        return await response.json(content_type=None)
+
+# ================ METRICS ================
+
+# Everything here is updated from the event loop thread only, so no locks:
+# a counter bump is a dict update and a histogram observation is one bisect
+# into fixed buckets. Cumulative bucket counts are only built when scraped.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+def format_labels(names, values, extra=""):
+    """Render a Prometheus label set like {a="1",b="2"}"""
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic count per label tuple"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def expose(self):
+        for labels, value in self.values.items():
+            yield "{}{} {}".format(self.name, format_labels(self.labelnames, labels), format_value(value))
+
+class HistogramSeries:
+    """Bucket counts of one label tuple; the last slot is the +Inf bucket"""
+
+    __slots__ = ("bounds", "counts", "total")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+class Histogram:
+    """Fixed-bucket histogram per label tuple; hot callers keep the series from labels()"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def labels(self, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = HistogramSeries(self.buckets)
+        return series
+
+    def observe(self, value, labels=()):
+        self.labels(*labels).observe(value)
+
+    def expose(self):
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += count
+                yield "{}_bucket{} {}".format(
+                    self.name, format_labels(self.labelnames, labels, 'le="{}"'.format(format_value(bound))), cumulative
+                )
+            label_text = format_labels(self.labelnames, labels)
+            yield "{}_sum{} {}".format(self.name, label_text, format_value(series.total))
+            yield "{}_count{} {}".format(self.name, label_text, cumulative)
+
+class CollectedMetric:
+    """Counter or gauge read at scrape time from counts a component already keeps"""
+
+    def __init__(self, name, help_text, kind, labelnames, collect):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labelnames = labelnames
+        self.collect = collect  # () -> iterable of (label tuple, value)
+
+    def expose(self):
+        for labels, value in self.collect():
+            yield "{}{} {}".format(self.name, format_labels(self.labelnames, labels), format_value(value))
+
+class MetricsRegistry:
+    """Named metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(self.prefix + name, help_text, labelnames))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labelnames=()):
+        return self._add(Histogram(self.prefix + name, help_text, buckets, labelnames))
+
+    def collected(self, name, help_text, kind, labelnames, collect):
+        return self._add(CollectedMetric(self.prefix + name, help_text, kind, labelnames, collect))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help_text))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            try:
+                lines.extend(metric.expose())
+            except Exception as e:
+                logging.error("Metrics Error: {}: {}".format(metric.name, e))
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry("ffbot_")
+
+command_requests = metrics.counter(
+    "commands_total", "Commands handled, by command word and outcome", ("command", "outcome")
+)
+command_latency = metrics.histogram(
+    "command_duration_seconds", "Time from dispatch to handler completion", labelnames=("command",)
+)
+upstream_requests = metrics.counter(
+    "upstream_requests_total", "Upstream API attempts by status code or failure kind", ("upstream", "endpoint", "status")
+)
+upstream_latency = metrics.histogram(
+    "upstream_request_duration_seconds", "Upstream API attempt latency", labelnames=("upstream", "endpoint")
+)
+auth_rejects = metrics.counter(
+    "auth_rejects_total", "Dot-commands dropped by the ACL or owner-only check", ("reason",)
+)
+loop_lag_histogram = metrics.histogram(
+    "event_loop_lag_seconds", "How late periodic loop-lag probes woke up", buckets=LOOP_LAG_BUCKETS
+)
+
+def observe_command(name, outcome, elapsed):
+    command_requests.inc((name, outcome))
+    command_latency.observe(elapsed, (name,))
+
+# ================ UPSTREAM RESILIENCE ================
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream endpoint whose breaker is open"""
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty sequence"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker with a latency-derived timeout.
+    closed -> open after `failure_threshold` consecutive failures,
+    open -> half-open after `reset_timeout` seconds (one probe request),
+    half-open -> closed on success / open on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    # Timeout = p95 latency times this, clamped to [min_timeout, max_timeout]
+    TIMEOUT_MULTIPLIER = 3
+    MIN_SAMPLES = 10
+    # Smoothing factor for the running latency / error-rate health score
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, name, max_timeout, labels=None):
+        self.name = name
+        self.max_timeout = max_timeout
+        # (upstream, endpoint) metric labels; attempts are timed into this series
+        self.labels = labels or (name, "")
+        self.latency_series = upstream_latency.labels(*self.labels)
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.latencies = deque(maxlen=200)
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.rejected = 0
+        self.ewma_latency = None
+        self.error_rate = 0.0
+        self._probe_in_flight = False
+
+    def allow_request(self):
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < BREAKER_RESET_TIMEOUT:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def observe_latency(self, latency):
+        """Feed the running latency score without touching breaker state"""
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency += self.EWMA_ALPHA * (latency - self.ewma_latency)
+
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        self.observe_latency(latency)
+        self.error_rate -= self.EWMA_ALPHA * self.error_rate
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.error_rate += self.EWMA_ALPHA * (1 - self.error_rate)
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+            if self.state != self.OPEN:
+                logging.warning("Circuit breaker '{}' opened".format(self.name))
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """Let another request probe if the current one ended without an outcome"""
+        self._probe_in_flight = False
+
+    def timeout(self):
+        if len(self.latencies) < self.MIN_SAMPLES:
+            return self.max_timeout
+        adaptive = percentile(self.latencies, 0.95) * self.TIMEOUT_MULTIPLIER
+        return max(UPSTREAM_MIN_TIMEOUT, min(self.max_timeout, adaptive))
+
+    def is_rejecting(self):
+        """True while open and not yet due for a half-open probe"""
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < BREAKER_RESET_TIMEOUT
+
+    def score(self):
+        """Lower is healthier; endpoints never measured score 0 so they get tried"""
+        if self.is_rejecting():
+            return float("inf")
+        return (self.ewma_latency or 0.0) * (1 + 4 * self.error_rate)
+
+    def hedge_delay(self):
+        """p95 latency once enough samples exist, else None (no hedging)"""
+        if len(self.latencies) < self.MIN_SAMPLES:
+            return None
+        return percentile(self.latencies, 0.95)
+
+    def describe(self):
+        lines = ["{}: {}".format(self.name, self.state.upper())]
+        if self.latencies:
+            lines.append("  p50 {:.2f}s | p95 {:.2f}s | timeout {:.1f}s".format(
+                percentile(self.latencies, 0.5), percentile(self.latencies, 0.95), self.timeout()
+            ))
+        lines.append("  ok {} | fail {} | timeout {} | retry {} | rejected {}".format(
+            self.successes, self.failures, self.timeouts, self.retries, self.rejected
+        ))
+        return lines
+
+def upstream_status(error):
+    """Metric label for how an upstream attempt failed"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return str(error.status)
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, aiohttp.ClientConnectionError):
+        return "connection_error"
+    return "error"
+
+def is_transient_error(error):
+    """5xx responses and dropped connections are worth retrying"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, aiohttp.ClientConnectionError)
+
+async def upstream_get(breaker, url):
+    """GET JSON through a circuit breaker with adaptive timeout and jittered retries"""
+    if not breaker.allow_request():
+        upstream_requests.inc(breaker.labels + ("circuit_open",))
+        raise CircuitOpenError("{} endpoint circuit is open".format(breaker.name))
+    try:
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                data = await fetch_json(url, breaker.timeout())
+            except Exception as e:
+                breaker.latency_series.observe(time.monotonic() - started)
+                upstream_requests.inc(breaker.labels + (upstream_status(e),))
+                if attempt < UPSTREAM_RETRIES and is_transient_error(e):
+                    attempt += 1
+                    breaker.retries += 1
+                    # Full jitter keeps retries from many callers from lining up
+                    await asyncio.sleep(random.uniform(0, UPSTREAM_RETRY_BASE_DELAY * 2 ** attempt))
+                    continue
+                if isinstance(e, asyncio.TimeoutError):
+                    breaker.timeouts += 1
+                if isinstance(e, aiohttp.ClientResponseError) and e.status < 500:
+                    # The API answered; a 4xx says nothing about its health
+                    breaker.record_success(time.monotonic() - started)
+                else:
+                    breaker.record_failure()
+                raise
+            latency = time.monotonic() - started
+            breaker.latency_series.observe(latency)
+            upstream_requests.inc(breaker.labels + ("ok",))
+            breaker.record_success(latency)
+            return data
+    finally:
+        breaker.release_probe()
+
+# ================ UPSTREAM POOL ================
+
+class Upstream:
+    """One API base URL with a circuit breaker per endpoint"""
+
+    # Max timeouts per endpoint are the old fixed values
+    ENDPOINT_TIMEOUTS = {"profile": 10, "stats": 15}
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        host = base_url.split("://", 1)[-1]
+        self.breakers = {
+            endpoint: CircuitBreaker("{} {}".format(host, endpoint), max_timeout, (host, endpoint))
+            for endpoint, max_timeout in self.ENDPOINT_TIMEOUTS.items()
+        }
+
+    async def get(self, endpoint, path):
+        return await upstream_get(self.breakers[endpoint], self.base_url + path)
+
+upstream_pool = [Upstream(url) for url in API_BASE_URLS]
+hedge_stats = {"hedged": 0, "hedge_wins": 0}
+
+def is_client_error(error):
+    """4xx answers are final - another endpoint would say the same"""
+    return isinstance(error, aiohttp.ClientResponseError) and error.status < 500
+
+class HedgeFailed(Exception):
+    """A hedged GET failed; `secondary_started` says whether the second endpoint was asked too"""
+
+    def __init__(self, error, secondary_started):
+        super().__init__(str(error))
+        self.error = error
+        self.secondary_started = secondary_started
+
+async def hedged_get(primary, secondary, endpoint, path):
+    """Ask `primary`; if it is slower than its p95, also ask `secondary` and take the first success"""
+    delay = primary.breakers[endpoint].hedge_delay()
+    if delay is None:
+        try:
+            return await primary.get(endpoint, path)
+        except Exception as e:
+            raise HedgeFailed(e, False)
+    
+    started = time.monotonic()
+    first = asyncio.ensure_future(primary.get(endpoint, path))
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            if first.exception() is not None:
+                # Failed before the hedge was due - the caller still has to try `secondary`
+                raise HedgeFailed(first.exception(), False)
+            return first.result()
+        
+        hedge_stats["hedged"] += 1
+        second = asyncio.ensure_future(secondary.get(endpoint, path))
+        pending.add(second)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        hedge_stats["hedge_wins"] += 1
+                        # The primary lost the race: it is at least this slow
+                        primary.breakers[endpoint].observe_latency(time.monotonic() - started)
+                    return task.result()
+                # Prefer reporting the primary's error
+                if error is None or task is first:
+                    error = task.exception()
+        raise HedgeFailed(error, True)
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def api_get(endpoint, path):
+    """GET `path` from the healthiest upstream, failing over to the others"""
+    candidates = sorted(upstream_pool, key=lambda upstream: upstream.breakers[endpoint].score())
+    last_error = None
+    
+    if UPSTREAM_HEDGE and len(candidates) > 1:
+        try:
+            return await hedged_get(candidates[0], candidates[1], endpoint, path)
+        except HedgeFailed as e:
+            if is_client_error(e.error):
+                raise e.error
+            last_error = e.error
+            candidates = candidates[2 if e.secondary_started else 1:]
+    
+    for upstream in candidates:
+        try:
+            return await upstream.get(endpoint, path)
+        except Exception as e:
+            if is_client_error(e):
+                raise
+            last_error = e
+    raise last_error
+
+# ================ RESPONSE CACHE ================
+
+class CacheEntry(namedtuple("CacheEntry", "value fetched_at ttl")):
+    """Cached payload with the wall-clock time it was fetched"""
+    __slots__ = ()
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at
+
+    @property
+    def fresh(self):
+        return self.age < self.ttl
+
+class TTLCache:
+    """Bounded LRU cache; entries are fresh for their TTL and kept `stale_ttl` longer"""
+
+    def __init__(self, max_entries, stale_ttl=0):
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_entry(self, key):
+        """Return the CacheEntry, fresh or stale, or None once it has expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.fetched_at + entry.ttl + self.stale_ttl <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        if entry.fresh:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+        return entry
+
+    def set(self, key, value, ttl, fetched_at=None):
+        self._entries[key] = CacheEntry(value, time.time() if fetched_at is None else fetched_at, ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key):
+        """Return the CacheEntry without touching LRU order or counters"""
+        return self._entries.get(key)
+
+# Player profiles and stats keyed by (server, uid, matchmode, gamemode)
+player_cache = TTLCache(CACHE_MAX_ENTRIES, stale_ttl=max(STALE_WHILE_REVALIDATE, STALE_IF_ERROR))
+
+def is_profile_missing(data):
+    """True when a profile payload means the player does not exist"""
+    return "error" in data or "basicinfo" not in data
+
+def is_stats_missing(data):
+    """True when a stats payload is an API-side failure"""
+    return not data.get("success", False)
+
+# ================ PERSISTENT CACHE ================
+
+class DiskCache:
+    """
+    SQLite store of upstream payloads that survives process restarts. The
+    row count is taken when the file is opened and tracked on each write,
+    so the oldest rows are dropped as soon as a write goes past `max_rows`.
+    """
+
+    def __init__(self, path, max_rows, stale_ttl=0):
+        self.path = path
+        self.max_rows = max_rows
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+        self._rows = 0
+        # One worker thread keeps SQLite off the event loop and serializes access
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-cache")
+
+    @staticmethod
+    def _key(key):
+        return ":".join("" if part is None else str(part) for part in key)
+
+    def _connection(self):
+        # Opened lazily on first use so startup never touches the disk
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS player_cache ("
+                "key TEXT PRIMARY KEY, payload BLOB NOT NULL, "
+                "fetched_at REAL NOT NULL, ttl REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS player_cache_fetched_at ON player_cache (fetched_at)")
+            self._rows = conn.execute("SELECT COUNT(*) FROM player_cache").fetchone()[0]
+            self._prune(conn)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _get(self, key):
+        row = self._connection().execute(
+            "SELECT payload, fetched_at, ttl FROM player_cache WHERE key = ?", (self._key(key),)
+        ).fetchone()
+        if row is None:
+            return None
+        payload, fetched_at, ttl = row
+        return json.loads(zlib.decompress(payload)), fetched_at, ttl
+
+    def _put(self, key, value, fetched_at, ttl):
+        conn = self._connection()
+        payload = zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+        db_key = self._key(key)
+        # Refreshing a row does not grow the table; only new keys count
+        if conn.execute("SELECT 1 FROM player_cache WHERE key = ?", (db_key,)).fetchone() is None:
+            self._rows += 1
+        conn.execute(
+            "INSERT OR REPLACE INTO player_cache (key, payload, fetched_at, ttl) VALUES (?, ?, ?, ?)",
+            (db_key, payload, fetched_at, ttl),
+        )
+        self._prune(conn)
+        conn.commit()
+
+    def _prune(self, conn):
+        excess = self._rows - self.max_rows
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM player_cache WHERE key IN "
+                "(SELECT key FROM player_cache ORDER BY fetched_at LIMIT ?)",
+                (excess,),
+            )
+            self._rows -= excess
+            self.evictions += excess
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def get(self, key):
+        """Return a CacheEntry for a row still inside its TTL + stale window, else None"""
+        try:
+            row = await asyncio.get_running_loop().run_in_executor(self._executor, self._get, key)
+        except Exception as e:
+            logging.error("Disk Cache Error: {}".format(e))
+            return None
+        if row is not None:
+            entry = CacheEntry(*row)
+            if entry.age < entry.ttl + self.stale_ttl:
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, value, ttl):
+        """Queue a write without waiting for it"""
+        future = self._executor.submit(self._put, key, value, time.time(), ttl)
+        future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future):
+        if future.exception() is not None:
+            logging.error("Disk Cache Error: {}".format(future.exception()))
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=False)
+
+disk_cache = DiskCache(PLAYER_CACHE_PATH, PLAYER_CACHE_MAX_ROWS, player_cache.stale_ttl) if PLAYER_CACHE_PATH else None
+
+async def get_cached_entry(key):
+    """Look an entry up in memory, then on disk (promoting disk hits to memory)"""
+    entry = player_cache.get_entry(key)
+    if entry is not None or disk_cache is None:
+        return entry
+    entry = await disk_cache.get(key)
+    if entry is not None:
+        player_cache.set(key, entry.value, entry.ttl, fetched_at=entry.fetched_at)
+    return entry
+
+def store_payload(key, value, ttl):
+    """Save a fresh payload to the memory and disk caches"""
+    # Fingerprint now, while the payload is new, rather than on the first render
+    payload_fingerprint(value)
+    player_cache.set(key, value, ttl)
+    if disk_cache is not None:
+        disk_cache.put(key, value, ttl)
+
+# ================ RENDER CACHE ================
+
+TEMPLATE_VERSION = 1  # Bump when a report layout changes so cached text is not reused
+
+# id(payload) -> (payload, fingerprint); holding the payload keeps its id from being reused
+payload_fingerprints = OrderedDict()
+
+def payload_fingerprint(payload):
+    """Short content hash of a payload, computed once per payload object"""
+    entry = payload_fingerprints.get(id(payload))
+    if entry is not None and entry[0] is payload:
+        payload_fingerprints.move_to_end(id(payload))
+        return entry[1]
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    fingerprint = hashlib.blake2b(encoded, digest_size=8).digest()
+    payload_fingerprints[id(payload)] = (payload, fingerprint)
+    while len(payload_fingerprints) > CACHE_MAX_ENTRIES:
+        payload_fingerprints.popitem(last=False)
+    return fingerprint
+
+class RenderCache:
+    """
+    Bounded LRU of finished message text keyed by (template version,
+    renderer, payload fingerprint, render options). A new payload or a
+    TEMPLATE_VERSION bump changes the key, so stale text is never served.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def render(self, name, renderer, payload, options):
+        key = (TEMPLATE_VERSION, name, payload_fingerprint(payload), tuple(sorted(options.items())))
+        text = self.entries.get(key)
+        if text is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return text
+        
+        self.misses += 1
+        text = renderer(payload, options)
+        self.entries[key] = text
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return text
+
+render_cache = RenderCache(RENDER_CACHE_MAX_ENTRIES)
+
+# ================ UPSTREAM JOB SCHEDULER ================
+
+# Priority classes (lower runs first)
+PRIORITY_OWNER = 0
+PRIORITY_USER = 1
+PRIORITY_BATCH = 2  # Items of a multi-UID .Cid, behind every interactive lookup
+PRIORITY_BACKGROUND = 3  # Prefetch and stale-while-revalidate refreshes
+
+class UpstreamBusyError(Exception):
+    """Raised when the scheduler refuses a job because its queue is full"""
+
+class JobDeadlineExceeded(Exception):
+    """Raised when a job could not finish before its deadline"""
+
+class Job:
+    __slots__ = ("key", "factory", "priority", "seq", "deadline", "future", "runner", "state")
+
+    def __init__(self, key, factory, priority, seq, deadline):
+        self.key = key
+        self.factory = factory
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.future = asyncio.get_running_loop().create_future()
+        self.runner = None
+        self.state = "queued"
+
+class UpstreamScheduler:
+    """
+    Fixed pool of workers that runs every upstream lookup in priority order
+    (owner > user > batch > background), with per-job deadlines and cancellation.
+    """
+
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.cancelled = 0
+        self.refused = 0
+        self.durations = deque(maxlen=200)
+        self._heap = []
+        self._seq = itertools.count()
+        self._jobs = {}
+        self._queued = 0
+        self._running = 0
+        self._has_jobs = asyncio.Event()
+        self._worker_tasks = []
+
+    def queued(self):
+        return self._queued
+
+    def running(self):
+        return self._running
+
+    def has_idle_worker(self):
+        return self._queued + self._running < self.workers
+
+    async def run(self, key, factory, priority=PRIORITY_USER, deadline=None):
+        """Queue factory() and wait for its result; cancelling the caller cancels the job"""
+        if not self._worker_tasks:
+            self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        # Background work only runs on otherwise idle capacity
+        if self._queued >= self.max_queue or (priority == PRIORITY_BACKGROUND and not self.has_idle_worker()):
+            self.refused += 1
+            raise UpstreamBusyError("upstream queue is full")
+        
+        job = Job(key, factory, priority, next(self._seq), time.monotonic() + (deadline or UPSTREAM_JOB_DEADLINE))
+        job.future.add_done_callback(lambda future: self._on_done(job))
+        self._jobs[key] = job
+        self._queued += 1
+        heapq.heappush(self._heap, (job.priority, job.seq, job))
+        self._has_jobs.set()
+        return await job.future
+
+    def _on_done(self, job):
+        if job.future.cancelled():
+            self.cancelled += 1
+            if job.state == "queued":
+                job.state = "done"
+                self._queued -= 1
+            elif job.runner is not None:
+                job.runner.cancel()
+        if self._jobs.get(job.key) is job and job.state == "done":
+            del self._jobs[job.key]
+
+    def promote(self, key, priority):
+        """Raise the priority of a queued job when a more important caller joins it"""
+        job = self._jobs.get(key)
+        if job is not None and job.state == "queued" and priority < job.priority:
+            job.priority = priority
+            # The old heap entry is skipped when popped (its priority no longer matches)
+            heapq.heappush(self._heap, (job.priority, job.seq, job))
+
+    def queue_status(self, key):
+        """(position, estimated wait in seconds) for a queued job, else None"""
+        job = self._jobs.get(key)
+        if job is None or job.state != "queued":
+            return None
+        ahead = sum(
+            1 for priority, seq, other in self._heap
+            if other.state == "queued" and priority == other.priority and (priority, seq) < (job.priority, job.seq)
+        )
+        average = sum(self.durations) / len(self.durations) if self.durations else 1.0
+        return ahead + 1, (ahead // self.workers + 1) * average
+
+    async def _next_job(self):
+        while True:
+            while not self._heap:
+                self._has_jobs.clear()
+                await self._has_jobs.wait()
+            priority, _, job = heapq.heappop(self._heap)
+            if job.state == "queued" and priority == job.priority:
+                return job
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            job.state = "running"
+            self._queued -= 1
+            now = time.monotonic()
+            if job.future.done():
+                # Cancelled while queued, before _on_done ran - nobody wants the result
+                job.state = "done"
+                continue
+            if now >= job.deadline:
+                self.expired += 1
+                job.state = "done"
+                if not job.future.done():
+                    job.future.set_exception(JobDeadlineExceeded("job expired while queued"))
+                continue
+            
+            self._running += 1
+            job.runner = asyncio.ensure_future(job.factory())
+            try:
+                # The deadline is enforced here, so a TimeoutError raised by the
+                # lookup itself (an HTTP timeout) still counts as a failure
+                finished, _ = await asyncio.wait({job.runner}, timeout=job.deadline - now)
+                if not finished:
+                    job.runner.cancel()
+                    await asyncio.wait({job.runner})
+            finally:
+                self._running -= 1
+                job.state = "done"
+            self.durations.append(time.monotonic() - now)
+            
+            if job.future.done():
+                # Cancelled by the caller while running
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+                continue
+            if not finished:
+                self.expired += 1
+                job.future.set_exception(JobDeadlineExceeded("job ran past its deadline"))
+            elif job.runner.cancelled():
+                job.future.cancel()
+            elif job.runner.exception() is not None:
+                self.failed += 1
+                job.future.set_exception(job.runner.exception())
+            else:
+                self.completed += 1
+                job.future.set_result(job.runner.result())
+
+    def describe(self):
+        return "⚙️ Jobs: running {}/{} | queued {} | done {} | failed {} | expired {} | cancelled {} | refused {}".format(
+            self._running, self.workers, self._queued, self.completed, self.failed,
+            self.expired, self.cancelled, self.refused
+        )
+
+upstream_scheduler = UpstreamScheduler(UPSTREAM_WORKERS, UPSTREAM_QUEUE_MAX)
+
+def priority_for(event):
+    return PRIORITY_OWNER if event.sender_id == OWNER_ID else PRIORITY_USER
+
+def profile_cache_key(uid, server="bd"):
+    return (server, uid, None, None)
+
+def stats_cache_key(uid, matchmode, gamemode, server="bd"):
+    return (server, uid, matchmode.upper(), gamemode.lower())
+
+# ================ SINGLE-FLIGHT ================
+
+# Upstream lookups currently in flight: request tuple -> [task, number of waiting callers]
+inflight_requests = {}
+single_flight_stats = {"started": 0, "coalesced": 0, "abandoned": 0}
+
+async def single_flight(key, factory):
+    """Share one in-flight factory() call between concurrent callers of the same key"""
+    entry = inflight_requests.get(key)
+    if entry is None or entry[0].cancelled():
+        task = asyncio.ensure_future(factory())
+        entry = inflight_requests[key] = [task, 0]
+        task.add_done_callback(lambda _: inflight_requests.pop(key, None) if inflight_requests.get(key) is entry else None)
+        single_flight_stats["started"] += 1
+    else:
+        single_flight_stats["coalesced"] += 1
+    
+    task = entry[0]
+    entry[1] += 1
+    try:
+        # Shield so one caller giving up does not cancel the lookup for the others
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # ...but once nobody is waiting any more, stop the upstream work too
+        if entry[1] == 1 and not task.done():
+            single_flight_stats["abandoned"] += 1
+            inflight_requests.pop(key, None)
+            task.cancel()
+        raise
+    finally:
+        entry[1] -= 1
+
+def log_load_failure(label, error, priority):
+    """Log a failed upstream load; background work turned away for lack of capacity is routine"""
+    if priority == PRIORITY_BACKGROUND and isinstance(error, UpstreamBusyError):
+        logging.debug("{} skipped, no idle worker: {}".format(label, error))
+        return
+    logging.error("{}: {}".format(label, str(error) or type(error).__name__))
+
+async def _load_player_data(key, uid, server, priority):
+    try:
+        path = "/get_player_personal_show?server={}&uid={}".format(server, uid)
+        data = await upstream_scheduler.run(key, lambda: api_get("profile", path), priority)
     except Exception as e:
-        logging.error("API Error: {}".format(e))
+        log_load_failure("API Error", e, priority)
         return None
+    ttl = NEGATIVE_CACHE_TTL if is_profile_missing(data) else PROFILE_CACHE_TTL
+    store_payload(key, data, ttl)
+    return data
 
-def fetch_player_stats(uid, matchmode="CAREER", gamemode="br", server="bd"):
-    """Fetch player stats from API"""
+async def _load_player_stats(key, uid, matchmode, gamemode, server, priority):
     try:
-        url = "https://freefire-api-hkqw.onrender.com/get_player_stats?server={}&uid={}&matchmode={}&gamemode={}".format(
-            server, uid, matchmode.upper(), gamemode.lower()
+        path = "/get_player_stats?server={}&uid={}&matchmode={}&gamemode={}".format(
+            server, uid, matchmode, gamemode
         )
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
-        return response.json()
+        data = await upstream_scheduler.run(key, lambda: api_get("stats", path), priority)
     except Exception as e:
-        logging.error("Stats API Error: {}".format(e))
+        log_load_failure("Stats API Error", e, priority)
         return None
+    ttl = NEGATIVE_CACHE_TTL if is_stats_missing(data) else STATS_CACHE_TTLS.get(matchmode, PROFILE_CACHE_TTL)
+    store_payload(key, data, ttl)
+    return data
+
+# ================ STALE-WHILE-REVALIDATE ================
+
+# Strong references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+def spawn_background(coro):
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def cached_lookup(key, loader, is_missing, refresh=False, priority=PRIORITY_USER):
+    """
+    Serve a lookup from cache, the upstream, or both.
+    `loader(priority)` fetches and stores a fresh payload.
+    Returns (data, stale_age): stale_age is None for fresh data, otherwise
+    the age in seconds of the cached payload that was served instead.
+    """
+    entry = await get_cached_entry(key)
+    # "Not found" payloads are never served stale
+    usable = entry is not None and not is_missing(entry.value)
+    
+    if entry is not None and not refresh:
+        if entry.fresh:
+            return entry.value, None
+        if usable and entry.age < entry.ttl + STALE_WHILE_REVALIDATE:
+            spawn_background(single_flight(key, lambda: loader(PRIORITY_BACKGROUND)))
+            return entry.value, entry.age
+    
+    upstream_scheduler.promote(key, priority)
+    data = await single_flight(key, lambda: loader(priority))
+    if data is None and usable:
+        # Upstream failed - fall back to the last good payload
+        return entry.value, entry.age
+    return data, None
+
+def stale_marker(age):
+    """Footer shown under replies that were served from an old cached payload"""
+    return "🕒 Cached {} ago".format(format_time(age))
+
+async def fetch_player_data(uid, server="bd", refresh=False, priority=PRIORITY_USER):
+    key = profile_cache_key(uid, server)
+    return await cached_lookup(
+        key, lambda job_priority: _load_player_data(key, uid, server, job_priority),
+        is_profile_missing, refresh, priority
+    )
+
+async def _stats_lookup(uid, matchmode, gamemode, server, refresh=False, priority=PRIORITY_USER):
+    matchmode = matchmode.upper()
+    gamemode = gamemode.lower()
+    key = stats_cache_key(uid, matchmode, gamemode, server)
+    return await cached_lookup(
+        key, lambda job_priority: _load_player_stats(key, uid, matchmode, gamemode, server, job_priority),
+        is_stats_missing, refresh, priority
+    )
+
+async def fetch_player_stats(uid, matchmode="CAREER", gamemode="br", server="bd", refresh=False, priority=PRIORITY_USER):
+    """Fetch player stats from API"""
+    key = stats_cache_key(uid, matchmode, gamemode, server)
+    prefetched = prefetched_keys.pop(key, None)
+    data, stale_age = await _stats_lookup(uid, matchmode, gamemode, server, refresh, priority)
+    # Only a lookup answered with the very payload a finished prefetch stored is a hit
+    if prefetched is not None and data is prefetched:
+        prefetch_stats["hits"] += 1
+    return data, stale_age
+
+# ================ SPECULATIVE PREFETCH ================
+
+prefetch_stats = {"started": 0, "hits": 0, "skipped": 0}
+# Key -> payload stored by a finished prefetch and not yet asked for (bounded, oldest dropped first)
+prefetched_keys = OrderedDict()
+# Start times of recent prefetches, for the per-minute budget
+prefetch_window = deque()
+
+def upstream_degraded(endpoint):
+    """True when no upstream has a closed breaker for `endpoint`"""
+    return all(upstream.breakers[endpoint].state != CircuitBreaker.CLOSED for upstream in upstream_pool)
+
+async def prefetch_stats_key(key, uid, matchmode, gamemode, server):
+    data = await single_flight(key, lambda: _load_player_stats(key, uid, matchmode, gamemode, server, PRIORITY_BACKGROUND))
+    # Failed or refused prefetches stored nothing, so they can never be hits
+    if data is not None:
+        prefetched_keys[key] = data
+        while len(prefetched_keys) > CACHE_MAX_ENTRIES:
+            prefetched_keys.popitem(last=False)
+
+def schedule_stats_prefetch(uid, server="bd"):
+    """Warm the stats cache with the combinations usually requested after .Cid"""
+    now = time.monotonic()
+    while prefetch_window and now - prefetch_window[0] > 60:
+        prefetch_window.popleft()
+    
+    for matchmode, gamemode in PREFETCH_STATS:
+        matchmode = matchmode.upper()
+        gamemode = gamemode.lower()
+        key = stats_cache_key(uid, matchmode, gamemode, server)
+        entry = player_cache.peek(key)
+        if (entry is not None and entry.fresh) or key in inflight_requests:
+            continue
+        if (upstream_degraded("stats") or not upstream_scheduler.has_idle_worker()
+                or len(prefetch_window) >= PREFETCH_BUDGET_PER_MINUTE):
+            prefetch_stats["skipped"] += 1
+            continue
+        prefetch_window.append(now)
+        prefetch_stats["started"] += 1
+        spawn_background(prefetch_stats_key(key, uid, matchmode, gamemode, server))
 
 def calculate_kd(kills, deaths):
     """Calculate K/D ratio"""
@@ -191,50 +1321,163 @@ def calculate_headshot_rate(headshot_kills, kills):
     except:
         return "N/A"
 
-# ================ PERCENTAGE TRANSFORMATION FUNCTION ================
+# ================ CALCULATOR ENGINE ================
 
-def transform_percentage(expression):
-    """
-    Transform percentage expressions for calculator:
-    A + B% -> A + (A * B / 100)
-    A - B% -> A - (A * B / 100)
-    A * B% -> A * (B / 100)
-    A / B% -> A / (B / 100)
-    B% (standalone) -> (B / 100)
+CALC_MAX_LENGTH = 200  # Characters per expression
+CALC_MAX_DEPTH = 32  # Nested parentheses / unary signs
+CALC_MAX_MAGNITUDE = 10 ** 15  # Largest absolute value of any number or intermediate result
+CALC_MAX_LINES = 30  # Expressions per multi-line .c message
+
+# One token per match: a number, a result reference (ans / #n), or any other single character
+CALC_TOKEN = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|(?i:(ans|#\d+))|(\S))')
+CALC_OPERATORS = "+-*/()%"
+CALC_PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2}
+
+def tokenize_expression(expression):
+    """Split an expression into ("num", value) / ("op", char) tokens in a single pass"""
+    tokens = []
+    for match in CALC_TOKEN.finditer(expression):
+        number, reference, char = match.groups()
+        if reference is not None:
+            tokens.append(("ref", reference.lower()))
+        elif number is not None:
+            value = float(number) if "." in number else int(number)
+            if abs(value) > CALC_MAX_MAGNITUDE:
+                raise ValueError("Number too large: {}".format(number))
+            tokens.append(("num", value))
+        elif char in CALC_OPERATORS:
+            tokens.append(("op", char))
+        else:
+            raise ValueError("Invalid character '{}'".format(char))
+    return tokens
+
+class CalcParser:
     """
-    expr = expression.replace(" ", "")
-    
-    if '%' not in expr:
-        return expr
-    
-    # Step 1: Handle A * B% → A * (B / 100)
-    expr = re.sub(r'\*(\d+\.?\d*)%', r'*(\1/100)', expr)
-    
-    # Step 2: Handle A / B% → A / (B / 100)
-    expr = re.sub(r'/(\d+\.?\d*)%', r'/(\1/100)', expr)
-    
-    # Step 3: Handle A + B% → A + (A * B / 100)
-    #         Handle A - B% → A - (A * B / 100)
-    def replace_plus_minus_percent(match):
-        a = match.group(1)
-        op = match.group(2)
-        b = match.group(3)
-        return a + op + '(' + a + '*' + b + '/100)'
+    Precedence-climbing parser producing a small tuple AST:
+    ("num", value), ("ref", "ans" | line number), ("neg", node), ("%", node),
+    ("of", node) and (op, left, right) where op is one of + - * / or the
+    percent forms "+%" / "-%".
     
-    pattern_plus_minus = r'(\d+\.?\d*)([+\-])(\d+\.?\d*)%'
-    
-    # Apply iteratively for chained operations
-    prev = ""
-    while prev != expr:
-        prev = expr
-        expr = re.sub(pattern_plus_minus, replace_plus_minus_percent, expr, count=1)
-    
-    # Step 4: Handle any remaining standalone B% → (B / 100)
-    expr = re.sub(r'(\d+\.?\d*)%', r'(\1/100)', expr)
-    
-    return expr
+    A term after + or - that starts with a bare B% ("100+10%*2") is
+    relative to the left-hand side: that B% becomes ("of", B), meaning B
+    percent of it, and the rest of the term scales that amount.
+    """
 
-# ================ SAFE CALCULATOR FUNCTION ================
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty expression")
+        node = self.expression(1, 0)
+        if self.pos < len(self.tokens):
+            raise ValueError("Unexpected '{}'".format(self.tokens[self.pos][1]))
+        return node
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def expression(self, min_precedence, depth, relative=False):
+        first = self.peek()
+        left = self.operand(depth)
+        if relative and left[0] == "%" and first is not None and first[0] != "op":
+            left = ("of", left[1])
+        while True:
+            token = self.peek()
+            if token is None or token[0] != "op" or CALC_PRECEDENCE.get(token[1], 0) < min_precedence:
+                return left
+            op = token[1]
+            self.pos += 1
+            right = self.expression(CALC_PRECEDENCE[op] + 1, depth, relative=op in "+-")
+            if op in "+-" and starts_with_percent_of(right):
+                # A ± B% is B percent of A, not A ± B/100
+                left = (op + "%", left, right)
+            else:
+                left = (op, left, right)
+
+    def operand(self, depth):
+        if depth > CALC_MAX_DEPTH:
+            raise ValueError("Expression nested too deeply (max {})".format(CALC_MAX_DEPTH))
+        token = self.peek()
+        if token is None:
+            raise ValueError("Expression ends too early")
+        self.pos += 1
+        
+        if token == ("op", "-"):
+            return ("neg", self.operand(depth + 1))
+        if token == ("op", "+"):
+            return self.operand(depth + 1)
+        if token[0] == "num":
+            node = ("num", token[1])
+        elif token[0] == "ref":
+            node = ("ref", "ans" if token[1] == "ans" else int(token[1][1:]))
+        elif token == ("op", "("):
+            node = self.expression(1, depth + 1)
+            if self.peek() != ("op", ")"):
+                raise ValueError("Missing ')'")
+            self.pos += 1
+        else:
+            raise ValueError("Unexpected '{}'".format(token[1]))
+        
+        if self.peek() == ("op", "%"):
+            self.pos += 1
+            node = ("%", node)
+        return node
+
+def starts_with_percent_of(node):
+    """True when the leftmost factor of a * / chain is an ("of", ...) node"""
+    while node[0] in ("*", "/"):
+        node = node[1]
+    return node[0] == "of"
+
+@functools.lru_cache(maxsize=512)
+def parse_expression(expression):
+    """Parse a calculator expression into its AST (see CalcParser); repeated formulas skip parsing"""
+    if len(expression) > CALC_MAX_LENGTH:
+        raise ValueError("Expression too long (max {} characters)".format(CALC_MAX_LENGTH))
+    # Spaces are ignored everywhere, including inside numbers ("1 000")
+    return CalcParser(tokenize_expression(expression.replace(" ", ""))).parse()
+
+def evaluate_expression(node, results=(), base=None):
+    """
+    Evaluate a parsed expression; every intermediate result is magnitude-checked.
+    `results` are the earlier lines of a multi-line .c (None where a line failed).
+    `base` is the left-hand side an ("of", ...) percentage is taken from.
+    """
+    kind = node[0]
+    if kind == "num":
+        return node[1]
+    if kind == "ref":
+        index = len(results) if node[1] == "ans" else node[1]
+        if not 1 <= index <= len(results) or results[index - 1] is None:
+            raise ValueError("{} has no result".format("ans" if node[1] == "ans" else "#{}".format(index)))
+        return results[index - 1]
+    if kind == "neg":
+        return -evaluate_expression(node[1], results)
+    if kind == "%":
+        value = evaluate_expression(node[1], results) / 100
+    elif kind == "of":
+        value = base * evaluate_expression(node[1], results) / 100
+    elif kind in ("+%", "-%"):
+        left = evaluate_expression(node[1], results)
+        amount = evaluate_expression(node[2], results, left)
+        value = left + amount if kind == "+%" else left - amount
+    else:
+        # Only the leftmost factor of a term can be an "of" percentage
+        left = evaluate_expression(node[1], results, base if kind in ("*", "/") else None)
+        right = evaluate_expression(node[2], results)
+        if kind == "+":
+            value = left + right
+        elif kind == "-":
+            value = left - right
+        elif kind == "*":
+            value = left * right
+        else:
+            value = left / right
+    if abs(value) > CALC_MAX_MAGNITUDE:
+        raise ValueError("Result too large (max {:,})".format(CALC_MAX_MAGNITUDE))
+    return value
 
 def safe_calculate(expression):
     """
@@ -244,33 +1487,30 @@ def safe_calculate(expression):
     A - B% = A - (A * B / 100)
     A * B% = A * (B / 100)
     A / B% = A / (B / 100)
+    A + B% * C = A + (A * B / 100) * C
     """
-    # Remove all spaces
-    expression = expression.replace(" ", "")
-    
-    # Check for empty expression
-    if not expression:
-        raise ValueError("Empty expression")
-    
-    # Security: Only allow numbers, operators, parentheses, decimal points, and %
-    allowed_pattern = r'^[\d+\-*/().%]+$'
-    if not re.match(allowed_pattern, expression):
-        raise ValueError("Invalid characters in expression")
-    
-    # Transform percentage expressions FIRST
-    expression = transform_percentage(expression)
-    
-    # Allow negative numbers at start or after operators
-    clean_expr = expression.replace('(-', '(0-').replace('--', '+')
-    if clean_expr.startswith('-'):
-        clean_expr = '0' + clean_expr
-    
-    # Evaluate using Python's eval with restricted globals
-    try:
-        result = eval(clean_expr, {"__builtins__": {}}, {})
-        return result
-    except Exception as e:
-        raise ValueError("Invalid expression: {}".format(str(e)))
+    return evaluate_expression(parse_expression(expression))
+
+def calculate_lines(expressions):
+    """
+    Evaluate expressions in order; `ans` is the previous line's result and
+    `#n` the result of line n. Returns (formatted result, error) per line.
+    """
+    results = []
+    rows = []
+    for expression in expressions:
+        try:
+            value = evaluate_expression(parse_expression(expression), results)
+        except ZeroDivisionError:
+            results.append(None)
+            rows.append((None, "Division by zero"))
+        except ValueError as e:
+            results.append(None)
+            rows.append((None, str(e)))
+        else:
+            results.append(value)
+            rows.append((format_calc_result(value), None))
+    return rows
 
 def format_calc_result(result):
     """Format calculation result nicely"""
@@ -287,436 +1527,1358 @@ def format_calc_result(result):
     else:
         return str(result)
 
-# ================ EXISTING FORMAT FUNCTIONS ================
+# ================ REPORT SCHEMA ================
 
-def format_br_stats(data, matchmode, uid):
-    """Format Battle Royale stats beautifully"""
-    try:
-        stats_data = data.get("data", {})
-        metadata = data.get("metadata", {})
-        
-        solo = stats_data.get("solostats", {})
-        duo = stats_data.get("duostats", {})
-        quad = stats_data.get("quadstats", {})
-        
-        lines = []
-        lines.append("```")
-        lines.append("🎮 FREE FIRE BATTLE ROYALE STATS")
-        lines.append("═════════════════════════════════════")
-        lines.append("")
-        lines.append("🆔 Player ID: {}".format(uid))
-        lines.append("📊 Match Mode: {}".format(matchmode.upper()))
-        lines.append("🎯 Game Mode: Battle Royale")
-        lines.append("🌍 Server: {}".format(metadata.get("server", "BD").upper()))
-        lines.append("")
-        
-        # ═══════════════ SOLO STATS ═══════════════
-        lines.append("👤 SOLO STATISTICS")
-        lines.append("─────────────────────────────────────")
-        solo_detailed = solo.get("detailedstats", {})
-        if solo.get("gamesplayed") or solo.get("kills") or solo.get("wins"):
-            games = solo.get("gamesplayed", 0)
-            kills = solo.get("kills", 0)
-            wins = solo.get("wins", 0)
-            deaths = solo_detailed.get("deaths", 0)
-            hs_kills = solo_detailed.get("headshotkills", 0)
-            
-            lines.append("🎮 Games Played: {}".format(format_number(games)))
-            lines.append("🏆 Wins: {} ({})".format(format_number(wins), calculate_winrate(wins, games)))
-            lines.append("💀 Kills: {}".format(format_number(kills)))
-            lines.append("☠️ Deaths: {}".format(format_number(deaths)))
-            lines.append("📈 K/D Ratio: {}".format(calculate_kd(kills, deaths)))
-            lines.append("🎯 Headshot Kills: {} ({})".format(format_number(hs_kills), calculate_headshot_rate(hs_kills, kills)))
-            lines.append("💥 Damage: {}".format(format_number(solo_detailed.get("damage", 0))))
-            lines.append("🔫 Highest Kills: {}".format(solo_detailed.get("highestkills", 0)))
-            lines.append("⏱️ Survival Time: {}".format(format_time(solo_detailed.get("survivaltime", 0))))
-            lines.append("🏃 Distance: {}".format(format_distance(solo_detailed.get("distancetravelled", 0))))
-            lines.append("📦 Pickups: {}".format(format_number(solo_detailed.get("pickups", 0))))
-            lines.append("🚗 Road Kills: {}".format(solo_detailed.get("roadkills", 0)))
-            lines.append("🔝 Top 10 Finishes: {}".format(solo_detailed.get("topntimes", 0)))
-        else:
-            lines.append("❌ No solo stats available")
-        lines.append("")
-        
-        # ═══════════════ DUO STATS ═══════════════
-        lines.append("👥 DUO STATISTICS")
-        lines.append("─────────────────────────────────────")
-        duo_detailed = duo.get("detailedstats", {})
-        if duo.get("gamesplayed") or duo.get("kills") or duo.get("wins"):
-            games = duo.get("gamesplayed", 0)
-            kills = duo.get("kills", 0)
-            wins = duo.get("wins", 0)
-            deaths = duo_detailed.get("deaths", 0)
-            hs_kills = duo_detailed.get("headshotkills", 0)
-            
-            lines.append("🎮 Games Played: {}".format(format_number(games)))
-            lines.append("🏆 Wins: {} ({})".format(format_number(wins), calculate_winrate(wins, games)))
-            lines.append("💀 Kills: {}".format(format_number(kills)))
-            lines.append("☠️ Deaths: {}".format(format_number(deaths)))
-            lines.append("📈 K/D Ratio: {}".format(calculate_kd(kills, deaths)))
-            lines.append("🎯 Headshot Kills: {} ({})".format(format_number(hs_kills), calculate_headshot_rate(hs_kills, kills)))
-            lines.append("💥 Damage: {}".format(format_number(duo_detailed.get("damage", 0))))
-            lines.append("🔫 Highest Kills: {}".format(duo_detailed.get("highestkills", 0)))
-            lines.append("👊 Knockdowns: {}".format(format_number(duo_detailed.get("knockdown", 0))))
-            lines.append("💉 Revives: {}".format(duo_detailed.get("revives", 0)))
-            lines.append("⏱️ Survival Time: {}".format(format_time(duo_detailed.get("survivaltime", 0))))
-            lines.append("🏃 Distance: {}".format(format_distance(duo_detailed.get("distancetravelled", 0))))
-            lines.append("📦 Pickups: {}".format(format_number(duo_detailed.get("pickups", 0))))
-            lines.append("🚗 Road Kills: {}".format(duo_detailed.get("roadkills", 0)))
-            lines.append("🔝 Top 10 Finishes: {}".format(duo_detailed.get("topntimes", 0)))
-        else:
-            lines.append("❌ No duo stats available")
-        lines.append("")
-        
-        # ═══════════════ SQUAD STATS ═══════════════
-        lines.append("👨‍👩‍👧‍👦 SQUAD STATISTICS")
-        lines.append("─────────────────────────────────────")
-        quad_detailed = quad.get("detailedstats", {})
-        if quad.get("gamesplayed") or quad.get("kills") or quad.get("wins"):
-            games = quad.get("gamesplayed", 0)
-            kills = quad.get("kills", 0)
-            wins = quad.get("wins", 0)
-            deaths = quad_detailed.get("deaths", 0)
-            hs_kills = quad_detailed.get("headshotkills", 0)
-            
-            lines.append("🎮 Games Played: {}".format(format_number(games)))
-            lines.append("🏆 Wins: {} ({})".format(format_number(wins), calculate_winrate(wins, games)))
-            lines.append("💀 Kills: {}".format(format_number(kills)))
-            lines.append("☠️ Deaths: {}".format(format_number(deaths)))
-            lines.append("📈 K/D Ratio: {}".format(calculate_kd(kills, deaths)))
-            lines.append("🎯 Headshot Kills: {} ({})".format(format_number(hs_kills), calculate_headshot_rate(hs_kills, kills)))
-            lines.append("💥 Damage: {}".format(format_number(quad_detailed.get("damage", 0))))
-            lines.append("🔫 Highest Kills: {}".format(quad_detailed.get("highestkills", 0)))
-            lines.append("👊 Knockdowns: {}".format(format_number(quad_detailed.get("knockdown", 0))))
-            lines.append("💉 Revives: {}".format(quad_detailed.get("revives", 0)))
-            lines.append("⏱️ Survival Time: {}".format(format_time(quad_detailed.get("survivaltime", 0))))
-            lines.append("🏃 Distance: {}".format(format_distance(quad_detailed.get("distancetravelled", 0))))
-            lines.append("📦 Pickups: {}".format(format_number(quad_detailed.get("pickups", 0))))
-            lines.append("🚗 Road Kills: {}".format(quad_detailed.get("roadkills", 0)))
-            lines.append("🔝 Top 10 Finishes: {}".format(quad_detailed.get("topntimes", 0)))
+# A report layout is a tuple of items, rendered top to bottom:
+#   "text"      - a literal line
+#   field(...)  - a "label: value" line read from the payload
+#   block(...)  - nested items under a sub-dict, optionally conditional
+# compile_report() turns a layout into one straight-line render function.
+
+Field = namedtuple("Field", "label paths formatter default optional template")
+Block = namedtuple("Block", "base items require_any option otherwise")
+
+EMPTY_SECTION = {}  # Shared stand-in for missing sub-dicts; never mutated
+
+def field(label, *paths, fmt=None, default=0, optional=False, template="{}"):
+    """
+    `label: fmt(values)` line, wrapped in `template`. `paths` are dotted keys
+    below the enclosing block ("@name" reads a render option); several paths
+    pass several values to `fmt`, with `default` a tuple of per-path defaults.
+    optional=True drops the line when the first value is falsy.
+    """
+    return Field(label, paths, fmt, default, optional, template)
+
+def block(base, items, require_any=(), option=None, otherwise=()):
+    """
+    Items rendered under the sub-dict at `base` ("" = same dict), only when
+    one of the `require_any` keys is truthy and the (name, value) `option`
+    matches (case-insensitive); otherwise the `otherwise` items.
+    """
+    return Block(base, tuple(items), tuple(require_any), option, tuple(otherwise))
+
+class ReportCompiler:
+    """Generates the Python source of render(data, options) for one layout"""
+
+    def __init__(self, name):
+        self.name = name
+        self.env = {"EMPTY": EMPTY_SECTION}
+        self.code = []
+        self.counter = itertools.count()
+
+    def compile(self, layout):
+        self.emit(0, "def render(data, options):")
+        self.emit(1, "lines = []")
+        self.items(layout, "data", {}, 1)
+        self.emit(1, 'return "\\n".join(lines)')
+        source = "\n".join(self.code)
+        exec(compile(source, "<report {}>".format(self.name), "exec"), self.env)
+        render = self.env["render"]
+        render.source = source
+        return render
+
+    def emit(self, depth, line):
+        self.code.append("    " * depth + line)
+
+    def variable(self):
+        return "_v{}".format(next(self.counter))
+
+    def constant(self, value):
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            return repr(value)
+        name = "_k{}".format(next(self.counter))
+        self.env[name] = value
+        return name
+
+    def section(self, keys, var, cache, depth):
+        """Variable holding the sub-dict at `keys` below `var`; each level is fetched once per scope"""
+        for key in keys:
+            if (var, key) not in cache:
+                sub = self.variable()
+                self.emit(depth, "{} = {}.get({!r}, EMPTY)".format(sub, var, key))
+                cache[(var, key)] = sub
+            var = cache[(var, key)]
+        return var
+
+    def lookup(self, path, var, cache, depth, default):
+        if path.startswith("@"):
+            return "options[{!r}]".format(path[1:])
+        keys = path.split(".")
+        parent = self.section(keys[:-1], var, cache, depth)
+        return "{}.get({!r}, {})".format(parent, keys[-1], self.constant(default))
+
+    def line(self, item, args):
+        """Expression for the whole line; label and template text become literals"""
+        if item.formatter is None:
+            value = "str({})".format(args[0])
         else:
-            lines.append("❌ No squad stats available")
+            value = "{}({})".format(self.constant(item.formatter), ", ".join(args))
+        prefix, suffix = item.template.split("{}")
+        code = "{} + {}".format(repr(item.label + ": " + prefix), value)
+        return code + " + " + repr(suffix) if suffix else code
+
+    def items(self, items, var, cache, depth):
+        # Runs of plain lines are added with one extend(); adjacent literal lines are merged
+        run = []
         
-        lines.append("")
-        lines.append("═════════════════════════════════════")
-        lines.append("```")
-        return "\n".join(lines)
+        def flush():
+            parts = []
+            for kind, text in run:
+                if kind == "text" and parts and parts[-1][0] == "text":
+                    parts[-1] = ("text", parts[-1][1] + "\n" + text)
+                else:
+                    parts.append((kind, text))
+            if parts:
+                self.emit(depth, "lines.extend(({},))".format(
+                    ", ".join(repr(text) if kind == "text" else text for kind, text in parts)
+                ))
+            del run[:]
         
-    except Exception as e:
-        logging.error("BR Stats Format Error: {}".format(e))
-        return "```\n❌ Error formatting BR stats: {}\n```".format(str(e))
+        for item in items:
+            if isinstance(item, str):
+                run.append(("text", item))
+            elif isinstance(item, Field):
+                if len(item.paths) > 1 and isinstance(item.default, tuple):
+                    defaults = item.default
+                else:
+                    defaults = (item.default,) * len(item.paths)
+                args = [self.lookup(path, var, cache, depth, default) for path, default in zip(item.paths, defaults)]
+                if not item.optional:
+                    run.append(("code", self.line(item, args)))
+                    continue
+                flush()
+                first = self.variable()
+                self.emit(depth, "{} = {}".format(first, args[0]))
+                self.emit(depth, "if {}:".format(first))
+                self.emit(depth + 1, "lines.append({})".format(self.line(item, [first] + args[1:])))
+            else:
+                flush()
+                self.block(item, var, cache, depth)
+        flush()
+
+    def block(self, item, var, cache, depth):
+        base = self.section(item.base.split(".") if item.base else (), var, cache, depth)
+        conditions = []
+        if item.option is not None:
+            name, expected = item.option
+            conditions.append("options[{!r}].upper() == {!r}".format(name, expected.upper()))
+        if item.require_any:
+            conditions.append("({})".format(" or ".join(
+                self.lookup(path, base, cache, depth, 0) for path in item.require_any
+            )))
+        if not conditions:
+            self.items(item.items, base, cache, depth)
+            return
+        # Sub-dicts first fetched inside a branch stay local to that branch
+        self.emit(depth, "if {}:".format(" and ".join(conditions)))
+        self.items(item.items, base, dict(cache), depth + 1)
+        if item.otherwise:
+            self.emit(depth, "else:")
+            self.items(item.otherwise, base, dict(cache), depth + 1)
+
+def compile_report(name, layout):
+    """Compile a report layout into a fast render(data, options) function"""
+    return ReportCompiler(name).compile(layout)
+
+def count_with_rate(rate):
+    """Formatter for "1,234 (12.34%)" fields: rate(count, total)"""
+    def formatter(count, total):
+        return "{} ({})".format(format_number(count), rate(count, total))
+    return formatter
+
+def upper(value):
+    return value.upper()
+
+# ================ EXISTING FORMAT FUNCTIONS ================
+
+STATS_RULE = "═════════════════════════════════════"
+STATS_DIVIDER = "─────────────────────────────────────"
+PROFILE_RULE = "═══════════════════════════════"
+
+def stats_header(title, game_name):
+    """Opening lines shared by the BR and CS stats messages"""
+    return (
+        "```",
+        title,
+        STATS_RULE,
+        "",
+        field("🆔 Player ID", "@uid"),
+        field("📊 Match Mode", "@matchmode", fmt=upper),
+        "🎯 Game Mode: " + game_name,
+        field("🌍 Server", "metadata.server", fmt=upper, default="BD"),
+        "",
+    )
+
+STATS_FOOTER = (STATS_RULE, "```")
+
+# Fields of one Battle Royale mode block; team-only fields are skipped for solo
+BR_MODE_FIELDS = (
+    (False, field("🎮 Games Played", "gamesplayed", fmt=format_number)),
+    (False, field("🏆 Wins", "wins", "gamesplayed", fmt=count_with_rate(calculate_winrate))),
+    (False, field("💀 Kills", "kills", fmt=format_number)),
+    (False, field("☠️ Deaths", "detailedstats.deaths", fmt=format_number)),
+    (False, field("📈 K/D Ratio", "kills", "detailedstats.deaths", fmt=calculate_kd)),
+    (False, field("🎯 Headshot Kills", "detailedstats.headshotkills", "kills", fmt=count_with_rate(calculate_headshot_rate))),
+    (False, field("💥 Damage", "detailedstats.damage", fmt=format_number)),
+    (False, field("🔫 Highest Kills", "detailedstats.highestkills")),
+    (True, field("👊 Knockdowns", "detailedstats.knockdown", fmt=format_number)),
+    (True, field("💉 Revives", "detailedstats.revives")),
+    (False, field("⏱️ Survival Time", "detailedstats.survivaltime", fmt=format_time)),
+    (False, field("🏃 Distance", "detailedstats.distancetravelled", fmt=format_distance)),
+    (False, field("📦 Pickups", "detailedstats.pickups", fmt=format_number)),
+    (False, field("🚗 Road Kills", "detailedstats.roadkills")),
+    (False, field("🔝 Top 10 Finishes", "detailedstats.topntimes")),
+)
+
+# Battle Royale modes: (name, payload field, short label, section title, team mode)
+BR_MODES = (
+    ("solo", "solostats", "👤 Solo", "👤 SOLO STATISTICS", False),
+    ("duo", "duostats", "👥 Duo", "👥 DUO STATISTICS", True),
+    ("squad", "quadstats", "👨‍👩‍👧‍👦 Squad", "👨‍👩‍👧‍👦 SQUAD STATISTICS", True),
+)
+
+def br_mode_section(name, field_name, title, team):
+    """One Battle Royale mode section (solo / duo / squad)"""
+    return (
+        title,
+        STATS_DIVIDER,
+        block(
+            "data." + field_name,
+            [line for team_only, line in BR_MODE_FIELDS if team or not team_only],
+            require_any=("gamesplayed", "kills", "wins"),
+            otherwise=("❌ No {} stats available".format(name),),
+        ),
+    )
+
+CS_STATS_LAYOUT = stats_header("⚔️ FREE FIRE CLASH SQUAD STATS", "Clash Squad") + (
+    block("data.csstats", (
+        "📊 GENERAL STATISTICS",
+        STATS_DIVIDER,
+        field("🎮 Games Played", "gamesplayed", fmt=format_number),
+        field("🏆 Wins", "wins", "gamesplayed", fmt=count_with_rate(calculate_winrate)),
+        field("💀 Kills", "kills", fmt=format_number),
+        field("☠️ Deaths", "detailedstats.deaths", fmt=format_number),
+        field("📈 K/D Ratio", "kills", "detailedstats.deaths", fmt=calculate_kd),
+        field("🎯 Headshot Kills", "detailedstats.headshotkills", "kills", fmt=count_with_rate(calculate_headshot_rate)),
+        field("💥 Damage", "detailedstats.damage", fmt=format_number),
+        field("👊 Knockdowns", "detailedstats.knockdowns", fmt=format_number),
+        field("🤝 Assists", "detailedstats.assists", fmt=format_number),
+        field("💉 Revivals", "detailedstats.revivals", fmt=format_number),
+        field("⭐ MVP Count", "detailedstats.mvpcount", fmt=format_number),
+        "",
+        "🔥 MULTI-KILL STATISTICS",
+        STATS_DIVIDER,
+        field("2️⃣ Double Kills", "detailedstats.doublekills", fmt=format_number),
+        field("3️⃣ Triple Kills", "detailedstats.triplekills", fmt=format_number),
+        field("4️⃣ Quadra Kills", "detailedstats.fourkills", fmt=format_number),
+        # Additional stats for ranked mode
+        block("detailedstats", (
+            "",
+            "🏅 RANKED STATISTICS",
+            STATS_DIVIDER,
+            field("⭐ Rating Points", "ratingpoints", fmt="{:.2f}".format, optional=True),
+            field("🎮 Ranked Games", "ratingenabledgames", optional=True),
+            field("🔥 Win Streak", "streakwins", optional=True),
+            field("🔫 Best Kills (1 Game)", "onegamemostkills", optional=True),
+            field("💥 Best Damage (1 Game)", "onegamemostdamage", fmt=format_number, optional=True),
+            field("🎯 Total Headshots", "headshotcount", fmt=format_number, optional=True),
+            field("🔫 Total Hits", "hitcount", fmt=format_number, optional=True),
+            field("💣 Grenade Kills", "throwingkills", optional=True),
+        ), option=("matchmode", "RANKED")),
+    ), require_any=("gamesplayed", "kills", "wins"), otherwise=("❌ No Clash Squad stats available",)),
+    "",
+) + STATS_FOOTER
+
+def region_label(region):
+    return "🇧🇩 Bangladesh" if region == "BD" else "🌍 " + str(region)
+
+def account_type_label(account_type):
+    return "Garena (1)" if account_type == 1 else "Guest (" + str(account_type) + ")"
+
+@functools.lru_cache(maxsize=4096)
+def _memo_date(timestamp):
+    return unix_to_date(timestamp)
+
+def profile_date(timestamp):
+    """unix_to_date, memoised: creation and veteran times repeat on every lookup of a player"""
+    try:
+        return _memo_date(timestamp)
+    except TypeError:
+        # Unhashable payload value
+        return unix_to_date(timestamp)
+
+def date_or_na(timestamp):
+    return profile_date(timestamp) if timestamp else "N/A"
+
+def rank_with_tier(rank):
+    return str(rank) + " 🏵️ (" + (get_rank_tier(int(rank)) if rank != "N/A" else "N/A") + ")"
+
+# Shared by the full profile and the profile section of .ps reports
+PROFILE_NICKNAME = field("👤 Nickname", "nickname", default="N/A")
+PROFILE_LEVEL = field("🏅 Level", "level", default="N/A")
+
+PROFILE_LAYOUT = (
+    "```",
+    "🎮 Free Fire Player Profile",
+    PROFILE_RULE,
+    "",
+    block("basicinfo", (
+        PROFILE_NICKNAME,
+        field("🆔 Player ID", "accountid", default="N/A"),
+        field("🌍 Region", "region", fmt=region_label, default="N/A"),
+        field("🧾 Account Type", "accounttype", fmt=account_type_label, default="N/A"),
+        PROFILE_LEVEL,
+        field("✨ EXP", "exp", fmt=format_number),
+        field("❤️ Likes", "liked", fmt=format_number),
+        field("📅 Created On", "createat", fmt=profile_date, default="N/A", template="🗓️ {}"),
+        field("🔑 Last Login", "lastloginat", fmt=profile_date, default="N/A", template="⏱️ {}"),
+        "",
+        "🏆 Rank Information",
+        PROFILE_RULE,
+        field("🎯 Battle Royale Rank", "rank", fmt=rank_with_tier, default="N/A"),
+        field("⭐ Ranking Points", "rankingpoints", fmt=format_number),
+        field("🚀 Max Rank", "maxrank", default="N/A"),
+        field("⚔️ Clash Squad Rank", "csrank", default="N/A"),
+        field("🎯 CS Points", "csrankingpoints"),
+        field("🦈 Hippo Rank", "hipporank", default="N/A"),
+    )),
+    "",
+    "🐾 Pet Information",
+    PROFILE_RULE,
+    block("petinfo", (
+        field("🐶 Pet Name", "name", default="N/A"),
+        field("🆔 Pet ID", "id", default="N/A"),
+        field("📈 Level", "level", "exp", fmt=lambda level, exp: str(level) + " — EXP: " + format_number(exp), default=("N/A", 0)),
+        field("🎨 Skin ID", "skinid", default="N/A"),
+        field("💥 Selected Skill ID", "selectedskillid", default="N/A"),
+    )),
+    "",
+    "✍️ Social Information",
+    PROFILE_RULE,
+    field("💬 Signature", "socialinfo.signature", default="N/A", template="\"{}\""),
+    "",
+    "🛡️ Veteran Status",
+    PROFILE_RULE,
+    field("🎖️ Expires", "basicinfo.veteranexpiretime", fmt=date_or_na, default="", template="🗓️ {}"),
+    "",
+    "⭐ Credit Score",
+    PROFILE_RULE,
+    field("🏅 Score", "creditscoreinfo.creditscore", default="N/A", template="{}/100"),
+    "```",
+)
+
+render_cs_stats = compile_report("cs", CS_STATS_LAYOUT)
+render_player_profile = compile_report("profile", PROFILE_LAYOUT)
 
 def format_cs_stats(data, matchmode, uid):
     """Format Clash Squad stats beautifully"""
     try:
-        stats_data = data.get("data", {})
-        metadata = data.get("metadata", {})
-        
-        cs = stats_data.get("csstats", {})
-        cs_detailed = cs.get("detailedstats", {})
-        
+        return render_cache.render("cs", render_cs_stats, data, {"uid": uid, "matchmode": matchmode})
+    except Exception as e:
+        logging.error("CS Stats Format Error: {}".format(e))
+        return "```\n❌ Error formatting CS stats: {}\n```".format(str(e))
+
+def summarize_mode_stats(stats):
+    """One-line summary of a solo/duo/quad/cs stats block, or None when empty"""
+    if not (stats.get("gamesplayed") or stats.get("kills") or stats.get("wins")):
+        return None
+    games = stats.get("gamesplayed", 0)
+    kills = stats.get("kills", 0)
+    wins = stats.get("wins", 0)
+    deaths = stats.get("detailedstats", {}).get("deaths", 0)
+    return "{} games | {} wins ({}) | K/D {}".format(
+        format_number(games), format_number(wins), calculate_winrate(wins, games), calculate_kd(kills, deaths)
+    )
+
+def mode_summary(stats):
+    return summarize_mode_stats(stats) or "No stats"
+
+# Sections of a .ps report; each is drawn on its own as soon as its payload arrives
+PROFILE_SECTION_LAYOUT = (block("basicinfo", (PROFILE_NICKNAME, PROFILE_LEVEL)),)
+STATS_SECTION_LAYOUTS = {
+    "br": tuple(
+        field(label, "data." + field_name, fmt=mode_summary, default=EMPTY_SECTION)
+        for name, field_name, label, title, team in BR_MODES
+    ),
+    "cs": (field("⚔️ CS", "data.csstats", fmt=mode_summary, default=EMPTY_SECTION),),
+}
+STATS_SECTION_LABELS = {"br": "🎮 BR", "cs": "⚔️ CS"}
+STATS_REPORT_TITLES = {"br": "🎮 FREE FIRE BATTLE ROYALE STATS", "cs": "⚔️ FREE FIRE CLASH SQUAD STATS"}
+
+render_profile_section = compile_report("section:profile", PROFILE_SECTION_LAYOUT)
+render_stats_sections = {
+    gamemode: compile_report("section:" + gamemode, layout) for gamemode, layout in STATS_SECTION_LAYOUTS.items()
+}
+
+def format_stats_report(uid, parts, payloads, pending=()):
+    """
+    .ps report: the profile, then one section per (matchmode, gamemode) in
+    `parts`, each drawn from its payload in `payloads`. Lookups listed in
+    `pending` ("profile" or a part) show as loading, failed ones as unavailable.
+    """
+    try:
         lines = []
         lines.append("```")
-        lines.append("⚔️ FREE FIRE CLASH SQUAD STATS")
-        lines.append("═════════════════════════════════════")
+        lines.append(STATS_REPORT_TITLES[parts[0][1]] if len(parts) == 1 else "📋 FREE FIRE FULL STATS REPORT")
+        lines.append(STATS_RULE)
         lines.append("")
         lines.append("🆔 Player ID: {}".format(uid))
-        lines.append("📊 Match Mode: {}".format(matchmode.upper()))
-        lines.append("🎯 Game Mode: Clash Squad")
-        lines.append("🌍 Server: {}".format(metadata.get("server", "BD").upper()))
-        lines.append("")
+        profile = payloads.get("profile")
+        if "profile" in pending:
+            lines.append("👤 Nickname: ⏳")
+        elif profile is not None and not is_profile_missing(profile):
+            lines.append(render_cache.render("section:profile", render_profile_section, profile, {}))
         
-        if cs.get("gamesplayed") or cs.get("kills") or cs.get("wins"):
-            games = cs.get("gamesplayed", 0)
-            kills = cs.get("kills", 0)
-            wins = cs.get("wins", 0)
-            deaths = cs_detailed.get("deaths", 0)
-            hs_kills = cs_detailed.get("headshotkills", 0)
-            
-            lines.append("📊 GENERAL STATISTICS")
-            lines.append("─────────────────────────────────────")
-            lines.append("🎮 Games Played: {}".format(format_number(games)))
-            lines.append("🏆 Wins: {} ({})".format(format_number(wins), calculate_winrate(wins, games)))
-            lines.append("💀 Kills: {}".format(format_number(kills)))
-            lines.append("☠️ Deaths: {}".format(format_number(deaths)))
-            lines.append("📈 K/D Ratio: {}".format(calculate_kd(kills, deaths)))
-            lines.append("🎯 Headshot Kills: {} ({})".format(format_number(hs_kills), calculate_headshot_rate(hs_kills, kills)))
-            lines.append("💥 Damage: {}".format(format_number(cs_detailed.get("damage", 0))))
-            lines.append("👊 Knockdowns: {}".format(format_number(cs_detailed.get("knockdowns", 0))))
-            lines.append("🤝 Assists: {}".format(format_number(cs_detailed.get("assists", 0))))
-            lines.append("💉 Revivals: {}".format(format_number(cs_detailed.get("revivals", 0))))
-            lines.append("⭐ MVP Count: {}".format(format_number(cs_detailed.get("mvpcount", 0))))
-            lines.append("")
-            
-            lines.append("🔥 MULTI-KILL STATISTICS")
-            lines.append("─────────────────────────────────────")
-            lines.append("2️⃣ Double Kills: {}".format(format_number(cs_detailed.get("doublekills", 0))))
-            lines.append("3️⃣ Triple Kills: {}".format(format_number(cs_detailed.get("triplekills", 0))))
-            lines.append("4️⃣ Quadra Kills: {}".format(format_number(cs_detailed.get("fourkills", 0))))
-            
-            # Additional stats for ranked mode
-            if matchmode.upper() == "RANKED":
+        matchmode = None
+        for part in parts:
+            if part[0] != matchmode:
+                matchmode = part[0]
                 lines.append("")
-                lines.append("🏅 RANKED STATISTICS")
-                lines.append("─────────────────────────────────────")
-                if cs_detailed.get("ratingpoints"):
-                    lines.append("⭐ Rating Points: {:.2f}".format(cs_detailed.get("ratingpoints", 0)))
-                if cs_detailed.get("ratingenabledgames"):
-                    lines.append("🎮 Ranked Games: {}".format(cs_detailed.get("ratingenabledgames", 0)))
-                if cs_detailed.get("streakwins"):
-                    lines.append("🔥 Win Streak: {}".format(cs_detailed.get("streakwins", 0)))
-                if cs_detailed.get("onegamemostkills"):
-                    lines.append("🔫 Best Kills (1 Game): {}".format(cs_detailed.get("onegamemostkills", 0)))
-                if cs_detailed.get("onegamemostdamage"):
-                    lines.append("💥 Best Damage (1 Game): {}".format(format_number(cs_detailed.get("onegamemostdamage", 0))))
-                if cs_detailed.get("headshotcount"):
-                    lines.append("🎯 Total Headshots: {}".format(format_number(cs_detailed.get("headshotcount", 0))))
-                if cs_detailed.get("hitcount"):
-                    lines.append("🔫 Total Hits: {}".format(format_number(cs_detailed.get("hitcount", 0))))
-                if cs_detailed.get("throwingkills"):
-                    lines.append("💣 Grenade Kills: {}".format(cs_detailed.get("throwingkills", 0)))
-        else:
-            lines.append("❌ No Clash Squad stats available")
+                lines.append("📊 {}".format(matchmode))
+                lines.append(STATS_DIVIDER)
+            gamemode = part[1]
+            data = payloads.get(part)
+            if part in pending:
+                lines.append("{}: ⏳ Loading...".format(STATS_SECTION_LABELS[gamemode]))
+            elif data is None or is_stats_missing(data):
+                lines.append("{}: ❌ Unavailable".format(STATS_SECTION_LABELS[gamemode]))
+            else:
+                lines.append(render_cache.render("section:" + gamemode, render_stats_sections[gamemode], data, {}))
         
         lines.append("")
-        lines.append("═════════════════════════════════════")
+        lines.append(STATS_RULE)
         lines.append("```")
         return "\n".join(lines)
         
     except Exception as e:
-        logging.error("CS Stats Format Error: {}".format(e))
-        return "```\n❌ Error formatting CS stats: {}\n```".format(str(e))
+        logging.error("Stats Report Format Error: {}".format(e))
+        return "```\n❌ Error formatting stats report: {}\n```".format(str(e))
+
+def summarize_player_line(uid, data, stale_age=None):
+    """One-line batch result for a .Cid lookup"""
+    if data is None:
+        return "⚠️ {} | API unavailable".format(uid)
+    if is_profile_missing(data):
+        return "❌ {} | Player not found".format(uid)
+    basic = data.get("basicinfo", {})
+    line = "✅ {} | {} | Lv {} | {}".format(
+        uid, basic.get("nickname", "N/A"), basic.get("level", "N/A"), basic.get("region", "N/A")
+    )
+    if stale_age is not None:
+        line += " 🕒"
+    return line
 
 def format_player_profile(data):
     try:
-        basic = data.get("basicinfo", {})
-        pet = data.get("petinfo", {})
-        social = data.get("socialinfo", {})
-        credit = data.get("creditscoreinfo", {})
-        
-        nickname = basic.get("nickname", "N/A")
-        player_id = basic.get("accountid", "N/A")
-        region = basic.get("region", "N/A")
-        account_type = basic.get("accounttype", "N/A")
-        level = basic.get("level", "N/A")
-        exp = format_number(basic.get("exp", 0))
-        likes = format_number(basic.get("liked", 0))
-        created_at = unix_to_date(basic.get("createat", "N/A"))
-        last_login = unix_to_date(basic.get("lastloginat", "N/A"))
-        
-        br_rank = basic.get("rank", "N/A")
-        rank_points = format_number(basic.get("rankingpoints", 0))
-        max_rank = basic.get("maxrank", "N/A")
-        cs_rank = basic.get("csrank", "N/A")
-        cs_points = basic.get("csrankingpoints", 0)
-        hippo_rank = basic.get("hipporank", "N/A")
-        
-        if br_rank != "N/A":
-            rank_tier = get_rank_tier(int(br_rank))
-        else:
-            rank_tier = "N/A"
-        
-        pet_name = pet.get("name", "N/A")
-        pet_id = pet.get("id", "N/A")
-        pet_level = pet.get("level", "N/A")
-        pet_exp = format_number(pet.get("exp", 0))
-        pet_skin = pet.get("skinid", "N/A")
-        pet_skill = pet.get("selectedskillid", "N/A")
-        
-        signature = social.get("signature", "N/A")
-        
-        veteran_expire = basic.get("veteranexpiretime", "")
-        if veteran_expire:
-            veteran_date = unix_to_date(veteran_expire)
-        else:
-            veteran_date = "N/A"
-        
-        credit_score = credit.get("creditscore", "N/A")
+        return render_cache.render("profile", render_player_profile, data, {})
+    except Exception as e:
+        logging.error("Format Error: {}".format(e))
+        return "```\nError formatting data: {}\n```".format(str(e))
+
+# ================ RATE LIMITING ================
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, per_minute, capacity):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until one token is available (after refill)"""
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def is_full(self):
+        return self.tokens >= self.capacity
+
+class RateLimiter:
+    """
+    Per-user, per-chat and global token buckets in front of upstream-backed
+    commands. Commands that cannot run at once wait in a per-chat queue that
+    is drained round-robin across chats; the owner has a queue of their own
+    that is always served first and is never rejected.
+    """
+
+    MAX_IDLE_BUCKETS = 1000
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(RATE_LIMIT_GLOBAL_PER_MIN, RATE_LIMIT_GLOBAL_BURST)
+        self.user_buckets = {}
+        self.chat_buckets = {}
+        self.owner_queue = deque()
+        # chat_id -> deque of (future, buckets, enqueued_at); dict order = round-robin order
+        self.chat_queues = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.wait_times = deque(maxlen=200)
+        self._drainer = None
+
+    def _bucket(self, buckets, key, per_minute, capacity):
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.MAX_IDLE_BUCKETS:
+                # A full bucket behaves exactly like a new one, so it can be dropped
+                now = time.monotonic()
+                for bucket in buckets.values():
+                    bucket.refill(now)
+                for idle_key in [k for k, b in buckets.items() if b.is_full()]:
+                    del buckets[idle_key]
+            bucket = buckets[key] = TokenBucket(per_minute, capacity)
+        return bucket
+
+    def _buckets_for(self, user_id, chat_id, is_owner):
+        if is_owner:
+            return [self.global_bucket]
+        return [
+            self.global_bucket,
+            self._bucket(self.chat_buckets, chat_id, RATE_LIMIT_CHAT_PER_MIN, RATE_LIMIT_CHAT_BURST),
+            self._bucket(self.user_buckets, user_id, RATE_LIMIT_USER_PER_MIN, RATE_LIMIT_USER_BURST),
+        ]
+
+    @staticmethod
+    def _can_take(buckets, now):
+        for bucket in buckets:
+            bucket.refill(now)
+        return all(bucket.tokens >= 1 for bucket in buckets)
+
+    def _try_take(self, buckets, now):
+        if self._can_take(buckets, now):
+            for bucket in buckets:
+                bucket.tokens -= 1
+            return True
+        return False
+
+    def _waiting_ahead(self, chat_id, is_owner, now):
+        """True when someone queued earlier could be admitted now and must go first"""
+        if self.owner_queue:
+            return True
+        if is_owner:
+            return False
+        # Other chats and throttled users in this chat do not hold this caller back
+        queue = self.chat_queues.get(chat_id, ())
+        return any(not future.done() and self._can_take(buckets, now) for future, buckets, _ in queue)
+
+    def depth(self):
+        return len(self.owner_queue) + sum(len(queue) for queue in self.chat_queues.values())
+
+    async def acquire(self, user_id, chat_id, is_owner=False):
+        """Wait for a slot; returns False when the command should be rejected instead"""
+        now = time.monotonic()
+        buckets = self._buckets_for(user_id, chat_id, is_owner)
+        if not self._waiting_ahead(chat_id, is_owner, now) and self._try_take(buckets, now):
+            self.admitted += 1
+            return True
         
-        if region == "BD":
-            region_display = "🇧🇩 Bangladesh"
+        if is_owner:
+            queue = self.owner_queue
         else:
-            region_display = "🌍 " + str(region)
+            queue = self.chat_queues.setdefault(chat_id, deque())
+            if len(queue) >= RATE_LIMIT_QUEUE_PER_CHAT:
+                self.rejected += 1
+                return False
         
-        if account_type == 1:
-            acc_type = "Garena (1)"
-        else:
-            acc_type = "Guest (" + str(account_type) + ")"
+        future = asyncio.get_running_loop().create_future()
+        queue.append((future, buckets, now))
+        self.queued += 1
+        self.max_depth = max(self.max_depth, self.depth())
+        self._wakeup.set()
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.ensure_future(self._drain())
         
-        lines = []
-        lines.append("```")
-        lines.append("🎮 Free Fire Player Profile")
-        lines.append("═══════════════════════════════")
-        lines.append("")
-        lines.append("👤 Nickname: " + str(nickname))
-        lines.append("🆔 Player ID: " + str(player_id))
-        lines.append("🌍 Region: " + region_display)
-        lines.append("🧾 Account Type: " + acc_type)
-        lines.append("🏅 Level: " + str(level))
-        lines.append("✨ EXP: " + str(exp))
-        lines.append("❤️ Likes: " + str(likes))
-        lines.append("📅 Created On: 🗓️ " + str(created_at))
-        lines.append("🔑 Last Login: ⏱️ " + str(last_login))
-        lines.append("")
-        lines.append("🏆 Rank Information")
-        lines.append("═══════════════════════════════")
-        lines.append("🎯 Battle Royale Rank: " + str(br_rank) + " 🏵️ (" + rank_tier + ")")
-        lines.append("⭐ Ranking Points: " + str(rank_points))
-        lines.append("🚀 Max Rank: " + str(max_rank))
-        lines.append("⚔️ Clash Squad Rank: " + str(cs_rank))
-        lines.append("🎯 CS Points: " + str(cs_points))
-        lines.append("🦈 Hippo Rank: " + str(hippo_rank))
-        lines.append("")
-        lines.append("🐾 Pet Information")
-        lines.append("═══════════════════════════════")
-        lines.append("🐶 Pet Name: " + str(pet_name))
-        lines.append("🆔 Pet ID: " + str(pet_id))
-        lines.append("📈 Level: " + str(pet_level) + " — EXP: " + str(pet_exp))
-        lines.append("🎨 Skin ID: " + str(pet_skin))
-        lines.append("💥 Selected Skill ID: " + str(pet_skill))
-        lines.append("")
-        lines.append("✍️ Social Information")
-        lines.append("═══════════════════════════════")
-        lines.append("💬 Signature: \"" + str(signature) + "\"")
-        lines.append("")
-        lines.append("🛡️ Veteran Status")
-        lines.append("═══════════════════════════════")
-        lines.append("🎖️ Expires: 🗓️ " + str(veteran_date))
-        lines.append("")
-        lines.append("⭐ Credit Score")
-        lines.append("═══════════════════════════════")
-        lines.append("🏅 Score: " + str(credit_score) + "/100")
-        lines.append("```")
+        try:
+            await asyncio.wait_for(future, None if is_owner else RATE_LIMIT_MAX_WAIT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        self.wait_times.append(time.monotonic() - now)
+        self.admitted += 1
+        return True
+
+    def _serve(self, queue, now):
+        """
+        Admit the earliest command in `queue` whose buckets allow it, so one
+        throttled user does not hold up the rest of the chat; returns seconds
+        until one could be admitted otherwise, or None for an empty queue.
+        """
+        wait = None
+        for index, (future, buckets, _) in enumerate(queue):
+            if future.done():
+                # Timed out or cancelled while waiting; dropped below
+                continue
+            if self._try_take(buckets, now):
+                del queue[index]
+                future.set_result(True)
+                wait = 0.0
+                break
+            entry_wait = max(bucket.wait_time() for bucket in buckets)
+            wait = entry_wait if wait is None else min(wait, entry_wait)
+        for index in range(len(queue) - 1, -1, -1):
+            if queue[index][0].done():
+                del queue[index]
+        return wait if queue or wait == 0.0 else None
+
+    async def _drain(self):
+        while True:
+            now = time.monotonic()
+            waits = []
+            
+            # Owner first, as long as they have anything waiting
+            wait = self._serve(self.owner_queue, now)
+            while wait == 0.0:
+                wait = self._serve(self.owner_queue, now)
+            if wait is not None:
+                waits.append(wait)
+            
+            # Then one command per chat, round-robin: a chat that was just
+            # served goes to the back, one that had to wait keeps its place
+            for chat_id in list(self.chat_queues):
+                queue = self.chat_queues[chat_id]
+                wait = self._serve(queue, now)
+                if not queue:
+                    del self.chat_queues[chat_id]
+                elif wait == 0.0:
+                    self.chat_queues.move_to_end(chat_id)
+                elif wait is not None:
+                    waits.append(wait)
+            
+            if not self.owner_queue and not self.chat_queues:
+                return
+            # Sleep until a bucket refills, or until a new command is queued
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(waits) if waits and min(waits) > 0 else 0.05)
+            except asyncio.TimeoutError:
+                pass
+
+    def describe(self):
+        line = "🚦 Rate limit: ok {} | queued {} | rejected {} | depth {} (max {})".format(
+            self.admitted, self.queued, self.rejected, self.depth(), self.max_depth
+        )
+        if self.wait_times:
+            line += "\n  wait p50 {:.1f}s | p95 {:.1f}s".format(
+                percentile(self.wait_times, 0.5), percentile(self.wait_times, 0.95)
+            )
+        return line
+
+rate_limiter = RateLimiter()
+
+# ================ OUTBOUND MESSAGES ================
+
+class OutboundJob:
+    """One queued send or edit; `future` resolves to the resulting message"""
+
+    __slots__ = ("kind", "key", "target", "text", "kwargs", "future", "enqueued_at", "started")
+
+    def __init__(self, kind, key, target, text, kwargs):
+        self.kind = kind
+        self.key = key
+        self.target = target
+        self.text = text
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.started = False
+
+class OutboundScheduler:
+    """
+    Per-chat queue for everything the bot sends or edits. Each chat is paced
+    by a token bucket, FloodWaitError defers the chat's queue instead of
+    failing, a queued edit is replaced by a newer edit of the same message,
+    and edits that would not change the text are skipped.
+    """
+
+    MAX_TRACKED_MESSAGES = 2000
+
+    def __init__(self):
+        self.queues = {}  # chat_id -> deque of OutboundJob
+        self.workers = {}  # chat_id -> drain task
+        self.buckets = {}  # chat_id -> TokenBucket
+        self.resume_at = {}  # chat_id -> monotonic time a FloodWait ends
+        self.pending_edits = {}  # (chat_id, message id) -> latest queued edit
+        self.last_text = OrderedDict()  # (chat_id, message id) -> text currently shown
+        self.sent = 0
+        self.edited = 0
+        self.coalesced = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.flood_seconds = 0
+        self.latencies = deque(maxlen=200)
+
+    def _bucket(self, chat_id):
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            # Positive ids are private chats, which tolerate a faster pace than groups
+            per_minute = OUTBOUND_PRIVATE_PER_MIN if chat_id and chat_id > 0 else OUTBOUND_GROUP_PER_MIN
+            bucket = self.buckets[chat_id] = TokenBucket(per_minute, OUTBOUND_BURST)
+        return bucket
+
+    def _remember(self, key, text):
+        self.last_text[key] = text
+        self.last_text.move_to_end(key)
+        while len(self.last_text) > self.MAX_TRACKED_MESSAGES:
+            self.last_text.popitem(last=False)
+
+    async def send(self, event, text, track=None, **kwargs):
+        """Queue a reply; `track` (a list) collects the job's future even if the caller is cancelled"""
+        job = OutboundJob("send", None, event, text, kwargs)
+        self._enqueue(event.chat_id, job)
+        if track is not None:
+            track.append(job.future)
+        return await asyncio.shield(job.future)
+
+    async def edit(self, message, text, **kwargs):
+        key = (message.chat_id, message.id)
+        pending = self.pending_edits.get(key)
+        if pending is not None and not pending.started:
+            # Only the newest text matters - fold this edit into the queued one
+            pending.text = text
+            pending.kwargs = kwargs
+            self.coalesced += 1
+            return await asyncio.shield(pending.future)
+        if pending is None and self.last_text.get(key) == text:
+            self.unchanged += 1
+            return message
         
-        return "\n".join(lines)
+        job = OutboundJob("edit", key, message, text, kwargs)
+        self.pending_edits[key] = job
+        self._enqueue(message.chat_id, job)
+        return await asyncio.shield(job.future)
+
+    def _enqueue(self, chat_id, job):
+        self.queues.setdefault(chat_id, deque()).append(job)
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.ensure_future(self._drain(chat_id))
+
+    async def _drain(self, chat_id):
+        queue = self.queues[chat_id]
+        bucket = self._bucket(chat_id)
+        try:
+            while queue:
+                now = time.monotonic()
+                bucket.refill(now)
+                delay = max(bucket.wait_time(), self.resume_at.get(chat_id, 0) - now)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                
+                job = queue[0]
+                if job.kind == "edit" and self.last_text.get(job.key) == job.text:
+                    self.unchanged += 1
+                    self._finish(queue, job, result=job.target)
+                    continue
+                
+                job.started = True
+                bucket.tokens -= 1
+                try:
+                    result = await self._perform(job)
+                except FloodWaitError as e:
+                    self.flood_waits += 1
+                    self.flood_seconds += e.seconds
+                    if e.seconds <= OUTBOUND_MAX_FLOOD_WAIT:
+                        # Keep the job at the head of the queue and retry once the wait is over
+                        logging.warning("Outbound FloodWait in chat {}: deferring {}s".format(chat_id, e.seconds))
+                        self.resume_at[chat_id] = time.monotonic() + e.seconds
+                        job.started = False
+                        continue
+                    self._finish(queue, job, error=e)
+                except Exception as e:
+                    self._finish(queue, job, error=e)
+                else:
+                    self._finish(queue, job, result=result)
+        finally:
+            del self.workers[chat_id]
+            if not queue:
+                del self.queues[chat_id]
+                self.resume_at.pop(chat_id, None)
+                bucket.refill(time.monotonic())
+                if bucket.is_full():
+                    del self.buckets[chat_id]
+
+    async def _perform(self, job):
+        if job.kind == "send":
+            message = await job.target.reply(job.text, **job.kwargs)
+            self.sent += 1
+            self._remember((message.chat_id, message.id), job.text)
+            return message
         
-    except Exception as e:
-        logging.error("Format Error: {}".format(e))
-        return "```\nError formatting data: {}\n```".format(str(e))
+        try:
+            result = await job.target.edit(job.text, **job.kwargs)
+        except MessageNotModifiedError:
+            self.unchanged += 1
+            result = job.target
+        else:
+            self.edited += 1
+        self._remember(job.key, job.text)
+        return result
+
+    def _finish(self, queue, job, result=None, error=None):
+        queue.popleft()
+        if job.kind == "edit" and self.pending_edits.get(job.key) is job:
+            del self.pending_edits[job.key]
+        self.latencies.append(time.monotonic() - job.enqueued_at)
+        if job.future.done():
+            return
+        if error is not None:
+            self.failed += 1
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def describe(self):
+        line = "📤 Outbound: sent {} | edited {} | coalesced {} | unchanged {} | failed {} | queued {}".format(
+            self.sent, self.edited, self.coalesced, self.unchanged, self.failed, self.depth()
+        )
+        line += "\n  FloodWait {} ({}s deferred)".format(self.flood_waits, self.flood_seconds)
+        if self.latencies:
+            line += " | latency p50 {:.2f}s | p95 {:.2f}s".format(
+                percentile(self.latencies, 0.5), percentile(self.latencies, 0.95)
+            )
+        return line
+
+outbound_scheduler = OutboundScheduler()
+
+async def send_reply(event, text, **kwargs):
+    """Reply to `event` through the outbound scheduler"""
+    # Replies sent by an upstream-backed command are remembered so they can be withdrawn if it is superseded
+    return await outbound_scheduler.send(event, text, track=command_replies.get(asyncio.current_task()), **kwargs)
+
+async def edit_message(message, text, **kwargs):
+    """Edit one of our messages through the outbound scheduler"""
+    return await outbound_scheduler.edit(message, text, **kwargs)
 
 # ================ FIXED AUTHORIZATION CHECKER ================
 
-async def is_authorized(event):
+def is_authorized(event):
     """Check if user and chat are authorized"""
-    global OWNER_ID
-    
     # Get sender ID - handle None case (FIX #3)
     user_id = event.sender_id
     if user_id is None:
         return False
     
-    chat_id = event.chat_id
-    
     # Use cached owner ID instead of calling API every time (FIX #1)
     # Owner always has access everywhere
     if user_id == OWNER_ID:
         return True
     
-    # Check if it's a private chat
-    if event.is_private:
-        # In private chats, check if user is authorized
-        if not authorized_user_ids:
-            return False
-        return user_id in authorized_user_ids
+    # Authorized users can use the bot anywhere
+    if user_id in authorized_user_ids:
+        return True
+    
+    # In groups/channels (FIX #2), everyone in an authorized group can use it
+    return not event.is_private and event.chat_id in authorized_group_ids
+
+def command_prefilter(event):
+    """
+    Telethon event filter: drop everything that is not a `.command` from an
+    authorized user/chat before the dispatcher runs.
+    """
+    text = event.raw_text
+    if not text or text[0] != ".":
+        return False
+    if is_authorized(event):
+        return True
+    auth_rejects.inc(("acl",))
+    return False
+
+def reload_acl():
+    """Reload authorized users/groups from ACL_FILE (or the environment when there is none)"""
+    global authorized_user_ids, authorized_group_ids
+    if ACL_FILE and os.path.exists(ACL_FILE):
+        with open(ACL_FILE, encoding="utf-8") as acl_file:
+            acl = json.load(acl_file)
+        users = frozenset(int(uid) for uid in acl.get("users", []))
+        groups = frozenset(int(gid) for gid in acl.get("groups", []))
     else:
-        # In groups/channels (FIX #2)
-        # First check if user is individually authorized (they can use bot anywhere)
-        if user_id in authorized_user_ids:
-            return True
-        
-        # Then check if group is authorized (all users in that group can use)
-        if authorized_group_ids and chat_id in authorized_group_ids:
-            return True
-        
-        # If neither user nor group is authorized, deny access
+        users = frozenset(int(uid) for uid in AUTHORIZED_USERS.replace(" ", "").split(",") if uid)
+        groups = frozenset(int(gid) for gid in AUTHORIZED_GROUPS.replace(" ", "").split(",") if gid)
+    # Swap both sets in one go; readers never see a half-updated ACL
+    authorized_user_ids, authorized_group_ids = users, groups
+
+def save_acl():
+    """Write the current ACL to ACL_FILE; returns False when no file is configured"""
+    if not ACL_FILE:
         return False
+    tmp_path = ACL_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as acl_file:
+        json.dump({"users": sorted(authorized_user_ids), "groups": sorted(authorized_group_ids)}, acl_file, indent=2)
+    os.replace(tmp_path, ACL_FILE)
+    return True
 
-# ================ COMMANDS ================
+if ACL_FILE:
+    try:
+        reload_acl()
+    except Exception as e:
+        logging.warning("Error loading ACL_FILE: {}".format(e))
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.Cid\s+(\d+)$'))
-async def cid_command(event):
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
+# ================ COMMAND ROUTER ================
+
+# Command word (lowercase, no leading dot or "!" suffix) -> [(compiled pattern, handler, upstream)]
+COMMANDS = {}
+# Command words only the owner may use
+OWNER_COMMANDS = set()
+
+# First word of a message that starts with "."
+COMMAND_WORD = re.compile(r'\.(\S+)')
+
+def command(name, pattern, owner_only=False, upstream=False):
+    """
+    Register a handler for `.name`; `pattern` is matched against the whole message.
+    upstream=True marks handlers that hit the API: they are rate limited and a
+    newer command of the same name from the same user/chat cancels the older one.
+    """
+    def decorator(func):
+        COMMANDS.setdefault(name.lower(), []).append((re.compile(pattern), func, upstream))
+        if owner_only:
+            OWNER_COMMANDS.add(name.lower())
+        return func
+    return decorator
+
+def find_routes(text):
+    """Return (command word, routes) for a `.command` message, else None"""
+    word = COMMAND_WORD.match(text)
+    if word is None:
+        return None
+    name = word.group(1).rstrip("!").lower()
+    routes = COMMANDS.get(name)
+    if routes is None:
+        return None
+    return name, routes
+
+def match_route(routes, text):
+    """Parse arguments for one command only: first (handler, match, upstream) whose pattern fits"""
+    for pattern, handler, upstream in routes:
+        match = pattern.match(text)
+        if match:
+            return handler, match, upstream
+    return None
+
+@client.on(events.NewMessage(func=command_prefilter))
+async def dispatch_command(event):
+    """Single entry point for `.command` messages that passed the ACL pre-filter"""
+    text = event.raw_text
+    found = find_routes(text)
+    if found is None:
+        return
+    name, routes = found
+    
+    # Owner-only commands - silently ignore everyone else
+    if name in OWNER_COMMANDS and event.sender_id != OWNER_ID:
+        auth_rejects.inc(("owner_only",))
+        return
+    
+    route = match_route(routes, text)
+    if route is None:
         return
+    handler, match, upstream = route
+    event.pattern_match = match
+    
+    # The loop watchdog reports stalls by task name; Telethon runs each update in its own task
+    asyncio.current_task().set_name(handler_label(name, handler))
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        if upstream:
+            outcome = "ok" if await run_latest_wins(event, name, handler) else "cancelled"
+        else:
+            await handler(event)
+            outcome = "ok"
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        observe_command(name, outcome, time.monotonic() - started)
+
+# ================ COMMAND CANCELLATION ================
+
+# (chat_id, sender_id, command word) -> task of the latest upstream-backed command
+active_commands = {}
+# Command message id -> (chat_id, task), to stop work when the command is deleted
+command_messages = {}
+cancel_stats = {"superseded": 0, "deleted": 0}
+# Command task -> futures of the replies it has sent
+command_replies = {}
+
+SUPERSEDED_TEXT = "```\n⏹ Cancelled — superseded by a newer request.\n```"
+
+async def mark_superseded(replies):
+    """Replace a superseded command's placeholder (and any partial output) with a short note"""
+    for future in replies:
+        try:
+            message = await asyncio.shield(future)
+            if message is not None:
+                await edit_message(message, SUPERSEDED_TEXT)
+        except Exception as e:
+            logging.error("Superseded Edit Error: {}".format(e))
+
+async def run_latest_wins(event, name, handler):
+    """Run an upstream-backed handler as a cancellable task; False if it was cancelled"""
+    # Latest wins: a newer command replaces this user's older one in this chat
+    slot = (event.chat_id, event.sender_id, name)
+    previous = active_commands.get(slot)
+    if previous is not None and not previous.done():
+        cancel_stats["superseded"] += 1
+        previous.cancel()
+    
+    task = asyncio.ensure_future(run_upstream_command(event, handler))
+    task.set_name(handler_label(name, handler))
+    active_commands[slot] = task
+    command_messages[event.id] = (event.chat_id, task)
+    replies = command_replies[task] = []
+    try:
+        await asyncio.wait({task})
+    finally:
+        # A newer command in the slot means this one was superseded rather than deleted
+        superseded = active_commands.get(slot) is not task
+        if not superseded:
+            del active_commands[slot]
+        command_messages.pop(event.id, None)
+        command_replies.pop(task, None)
+    if task.cancelled():
+        if superseded and replies:
+            spawn_background(mark_superseded(replies))
+        return False
+    if task.exception() is not None:
+        raise task.exception()
+    return True
+
+async def run_upstream_command(event, handler):
+    if not await rate_limiter.acquire(event.sender_id, event.chat_id, event.sender_id == OWNER_ID):
+        await send_reply(event, "```\n⏳ Slow down! Too many requests right now.\nPlease try again in a few seconds.\n```")
+        return
+    await handler(event)
+
+@client.on(events.MessageDeleted())
+async def command_deleted(event):
+    """Cancel in-flight commands whose message was deleted"""
+    for msg_id in event.deleted_ids:
+        entry = command_messages.get(msg_id)
+        if entry is None:
+            continue
+        chat_id, task = entry
+        # Private chats and small groups do not say which chat the deletion was in
+        if event.chat_id is not None and event.chat_id != chat_id:
+            continue
+        if not task.done():
+            cancel_stats["deleted"] += 1
+            task.cancel()
+
+# ================ COMMANDS ================
+
+QUEUE_STATUS_INTERVAL = 1.5  # Seconds between queue-position checks for a waiting lookup
+
+async def await_with_queue_status(lookup, key, processing_msg, processing_text):
+    """Await `lookup`, showing its upstream queue position in the placeholder while it waits"""
+    task = asyncio.ensure_future(lookup)
+    shown = None
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=QUEUE_STATUS_INTERVAL)
+            if done:
+                return task.result()
+            status = upstream_scheduler.queue_status(key)
+            if status is not None and status[0] != shown:
+                shown = status[0]
+                await edit_message(processing_msg, "{}\n⏳ Queue position: {} (~{})".format(
+                    processing_text, status[0], format_time(status[1])
+                ))
+    finally:
+        if not task.done():
+            task.cancel()
+
+class ProgressiveReply:
+    """
+    Placeholder message that is re-rendered as the parts of a multi-part
+    lookup arrive. The first update is shown at once; later ones are
+    debounced to one edit per STREAM_EDIT_INTERVAL.
+    """
+
+    def __init__(self, message, render, interval=None):
+        self.message = message
+        self.render = render
+        self.interval = STREAM_EDIT_INTERVAL if interval is None else interval
+        self.last_edit = 0.0
+        self.flush_task = None
+
+    def update(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        delay = self.last_edit + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.flush_task = None
+        self.last_edit = time.monotonic()
+        try:
+            await edit_message(self.message, self.render())
+        except Exception as e:
+            logging.error("Progressive Edit Error: {}".format(e))
+
+    def cancel(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+
+    async def finish(self, text=None):
+        """Drop any pending partial edit and show the final text"""
+        self.cancel()
+        await edit_message(self.message, self.render() if text is None else text)
+
+async def stream_stats_report(message, uid, parts, refresh=False, priority=PRIORITY_USER):
+    """
+    Fill `message` with the .ps report for `parts` ((matchmode, gamemode)
+    pairs), drawing each section as soon as its lookup finishes. Returns
+    (payloads, age of the stalest cached payload or None) once all are in.
+    """
+    pending = {"profile"} | set(parts)
+    total = len(pending)
+    payloads = {}
+    stale_ages = []
+    keys = {part: stats_cache_key(uid, *part) for part in parts}
+    keys["profile"] = profile_cache_key(uid)
+    
+    def render():
+        report = format_stats_report(uid, parts, payloads, pending)
+        report += "\n⏳ Loaded {}/{}...".format(total - len(pending), total)
+        positions = [status[0] for status in (upstream_scheduler.queue_status(keys[part]) for part in pending) if status]
+        if positions:
+            report += " | Queue position: {}".format(min(positions))
+        return report
+    
+    stream = ProgressiveReply(message, render)
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
     
+    async def load(part):
+        try:
+            async with semaphore:
+                if part == "profile":
+                    data, stale_age = await fetch_player_data(uid, refresh=refresh, priority=priority)
+                else:
+                    data, stale_age = await fetch_player_stats(uid, part[0], part[1], refresh=refresh, priority=priority)
+        except Exception as e:
+            # Keep whatever succeeded; failed lookups render as unavailable
+            logging.error("Stats Fan-out Error: {}".format(e))
+            data, stale_age = None, None
+        payloads[part] = data
+        if stale_age is not None:
+            stale_ages.append(stale_age)
+        pending.discard(part)
+        stream.update()
+    
+    tasks = {asyncio.ensure_future(load(part)) for part in pending}
+    try:
+        stream.update()
+        while tasks:
+            _, tasks = await asyncio.wait(tasks, timeout=QUEUE_STATUS_INTERVAL)
+            if tasks:
+                # Keeps the queue position current while lookups wait; unchanged text is not re-sent
+                stream.update()
+    finally:
+        stream.cancel()
+        for task in tasks:
+            task.cancel()
+    return payloads, max(stale_ages) if stale_ages else None
+
+def cached_profile(uid, server="bd"):
+    """Profile payload already held in memory, fresh or stale, without an upstream call"""
+    entry = player_cache.peek(profile_cache_key(uid, server))
+    if entry is None or entry.age >= entry.ttl + player_cache.stale_ttl:
+        return None
+    return entry.value
+
+def stats_report_text(uid, parts, payloads, stale_age):
+    """Finished .ps report, or an error message when the stats could not be loaded"""
+    stats = [payloads.get(part) for part in parts]
+    if all(data is None for data in stats):
+        return "```\n❌ Error: Unable to fetch data from API.\nPlease try again later.\n```"
+    if len(parts) == 1 and is_stats_missing(stats[0]):
+        return "```\n❌ Error: API returned failure.\nUID: {}\nPlease check if the UID is correct.\n```".format(uid)
+    report = format_stats_report(uid, parts, payloads)
+    if stale_age is not None:
+        report += "\n" + stale_marker(stale_age)
+    return report
+
+@command("cid", r'(?is)^\.Cid(!?)\s+(.+)$', upstream=True)
+async def cid_command(event):
     try:
-        uid = event.pattern_match.group(1)
+        # ".Cid! <uid>" skips the cache (owner only)
+        refresh = bool(event.pattern_match.group(1)) and event.sender_id == OWNER_ID
+        # Several UIDs switch to batch mode; only runs of 6+ digits count, so the
+        # numbering, bullets and labels of a pasted list ("1. 123...", "uid: 123...") are skipped
+        uids = list(dict.fromkeys(re.findall(r'\d{6,}', event.pattern_match.group(2))))
+        if not uids:
+            await send_reply(event, "```\n❌ No UIDs found!\n\nExample: .Cid 2716319203\n```")
+            return
+        if len(uids) > 1:
+            await cid_batch_lookup(event, uids, refresh)
+            return
+        uid = uids[0]
         
-        processing_msg = await event.reply("🔍 Fetching player details...")
+        processing_text = "🔍 Fetching player details..."
+        processing_msg = await send_reply(event, processing_text)
         
-        data = fetch_player_data(uid)
+        data, stale_age = await await_with_queue_status(
+            fetch_player_data(uid, refresh=refresh, priority=priority_for(event)),
+            profile_cache_key(uid), processing_msg, processing_text
+        )
         
         if data is None:
-            await processing_msg.edit("```\nError: Unable to fetch data from API.\n```")
+            await edit_message(processing_msg, "```\nError: Unable to fetch data from API.\n```")
             return
         
-        if "error" in data or "basicinfo" not in data:
-            await processing_msg.edit("```\nError: Player not found. UID: {}\n```".format(uid))
+        if is_profile_missing(data):
+            await edit_message(processing_msg, "```\nError: Player not found. UID: {}\n```".format(uid))
             return
         
         formatted_profile = format_player_profile(data)
+        if stale_age is not None:
+            formatted_profile += "\n" + stale_marker(stale_age)
         
-        await processing_msg.edit(formatted_profile)
+        await edit_message(processing_msg, formatted_profile)
+        
+        # A .ps for the same UID usually follows - warm the stats cache
+        if PREFETCH_STATS:
+            schedule_stats_prefetch(uid)
         
     except Exception as e:
         logging.error("Command Error: {}".format(e))
-        await event.reply("```\nError: {}\n```".format(str(e)))
+        await send_reply(event, "```\nError: {}\n```".format(str(e)))
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.ps\s+(\d+)\s+(\w+)\s+(\w+)$'))
-async def player_stats_command(event):
-    """Get player stats - .ps (uid) (matchmode) (gamemode)"""
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
+async def cid_batch_lookup(event, uids, refresh=False):
+    """Look up many UIDs concurrently, streaming a one-line-per-UID table"""
+    if len(uids) > CID_BATCH_MAX:
+        await send_reply(event, "```\n❌ Too many UIDs! Max {} per message, got {}.\n```".format(CID_BATCH_MAX, len(uids)))
         return
     
+    results = {}
+    pages = [uids[i:i + CID_BATCH_PAGE_SIZE] for i in range(0, len(uids), CID_BATCH_PAGE_SIZE)]
+    messages = [await send_reply(event, "🔍 Fetching {} players...".format(len(uids)))] + [None] * (len(pages) - 1)
+    rendered = [None] * len(pages)
+    
+    def render_page(index):
+        lines = []
+        lines.append("```")
+        lines.append("🎮 Batch Lookup — {}/{} done (page {}/{})".format(len(results), len(uids), index + 1, len(pages)))
+        lines.append("═══════════════════════════════")
+        for uid in pages[index]:
+            lines.append(results.get(uid, "⏳ {}".format(uid)))
+        if index == len(pages) - 1:
+            lines.append("═══════════════════════════════")
+            lines.append("💡 .Cid [UID] shows the full profile (cached)")
+        lines.append("```")
+        return "\n".join(lines)
+    
+    async def flush():
+        for index in range(len(pages)):
+            text = render_page(index)
+            if text == rendered[index]:
+                continue
+            if messages[index] is None:
+                messages[index] = await send_reply(event, text)
+            else:
+                await edit_message(messages[index], text)
+            rendered[index] = text
+    
+    # One command passed the rate limiter, so its items queue behind other
+    # users' interactive lookups and hold at most CID_BATCH_CONCURRENCY slots
+    semaphore = asyncio.Semaphore(CID_BATCH_CONCURRENCY)
+    priority = PRIORITY_OWNER if event.sender_id == OWNER_ID else PRIORITY_BATCH
+    
+    async def lookup(uid):
+        async with semaphore:
+            try:
+                data, stale_age = await fetch_player_data(uid, refresh=refresh, priority=priority)
+            except Exception as e:
+                logging.error("Batch Lookup Error: {}".format(e))
+                data, stale_age = None, None
+        results[uid] = summarize_player_line(uid, data, stale_age)
+    
+    pending = {asyncio.ensure_future(lookup(uid)) for uid in uids}
+    try:
+        while pending:
+            _, pending = await asyncio.wait(pending, timeout=CID_BATCH_EDIT_INTERVAL)
+            await flush()
+    finally:
+        for task in pending:
+            task.cancel()
+
+@command("ps", r'(?i)^\.ps(!?)\s+(\d+)\s+(\w+)\s+(\w+)$', upstream=True)
+async def player_stats_command(event):
+    """Get player stats - .ps (uid) (matchmode) (gamemode)"""
     try:
-        uid = event.pattern_match.group(1)
-        matchmode = event.pattern_match.group(2).upper()
-        gamemode = event.pattern_match.group(3).lower()
+        # ".ps! ..." skips the cache (owner only)
+        refresh = bool(event.pattern_match.group(1)) and event.sender_id == OWNER_ID
+        uid = event.pattern_match.group(2)
+        matchmode = event.pattern_match.group(3).upper()
+        gamemode = event.pattern_match.group(4).lower()
         
         # Validate matchmode
-        valid_matchmodes = ["CAREER", "NORMAL", "RANKED"]
-        if matchmode not in valid_matchmodes:
-            await event.reply("```\n❌ Invalid Match Mode!\n\nValid options: CAREER, NORMAL, RANKED\n\nExample: .ps 1710824990 CAREER br\n```")
+        if matchmode not in STATS_MATCHMODES:
+            await send_reply(event, "```\n❌ Invalid Match Mode!\n\nValid options: CAREER, NORMAL, RANKED\n\nExample: .ps 1710824990 CAREER br\n```")
             return
         
         # Validate gamemode
-        valid_gamemodes = ["br", "cs"]
-        if gamemode not in valid_gamemodes:
-            await event.reply("```\n❌ Invalid Game Mode!\n\nValid options: br, cs\n\nExample: .ps 1710824990 CAREER br\n```")
+        if gamemode not in STATS_GAMEMODES:
+            await send_reply(event, "```\n❌ Invalid Game Mode!\n\nValid options: br, cs\n\nExample: .ps 1710824990 CAREER br\n```")
             return
         
-        processing_msg = await event.reply("🔍 Fetching player stats for UID: {}...\n📊 Mode: {} | 🎯 Game: {}".format(uid, matchmode, gamemode.upper()))
-        
-        data = fetch_player_stats(uid, matchmode, gamemode)
+        processing_text = "🔍 Fetching player stats for UID: {}...\n📊 Mode: {} | 🎯 Game: {}".format(uid, matchmode, gamemode.upper())
+        processing_msg = await send_reply(event, processing_text)
         
-        if data is None:
-            await processing_msg.edit("```\n❌ Error: Unable to fetch data from API.\nPlease try again later.\n```")
+        # One lookup, one reply: the profile section is only added when it is already cached
+        data, stale_age = await await_with_queue_status(
+            fetch_player_stats(uid, matchmode, gamemode, refresh=refresh, priority=priority_for(event)),
+            stats_cache_key(uid, matchmode, gamemode), processing_msg, processing_text
+        )
+        payloads = {"profile": cached_profile(uid), (matchmode, gamemode): data}
+        summary = stats_summary_text(uid, matchmode, gamemode, payloads, stale_age)
+        if data is None or is_stats_missing(data):
+            await edit_message(processing_msg, summary)
             return
         
-        if not data.get("success", False):
-            await processing_msg.edit("```\n❌ Error: API returned failure.\nUID: {}\nPlease check if the UID is correct.\n```".format(uid))
-            return
+        # Compact summary; the per-mode pages open from it on demand
+        await edit_message(processing_msg, summary, buttons=stats_buttons(uid, matchmode, gamemode))
+        remember_stats_view(processing_msg, uid, matchmode, gamemode)
         
-        # Format stats based on gamemode
-        if gamemode == "br":
-            formatted_stats = format_br_stats(data, matchmode, uid)
-        else:
-            formatted_stats = format_cs_stats(data, matchmode, uid)
+    except Exception as e:
+        logging.error("Player Stats Command Error: {}".format(e))
+        await send_reply(event, "```\n❌ Error: {}\n```".format(str(e)))
+
+@command("ps", r'(?i)^\.ps(!?)\s+(\d+)\s+ALL$', upstream=True)
+async def player_stats_all_command(event):
+    """Get every matchmode x gamemode at once - .ps (uid) ALL"""
+    try:
+        refresh = bool(event.pattern_match.group(1)) and event.sender_id == OWNER_ID
+        uid = event.pattern_match.group(2)
         
-        await processing_msg.edit(formatted_stats)
+        processing_msg = await send_reply(event, "🔍 Fetching all stats for UID: {}...".format(uid))
+        
+        parts = [(matchmode, gamemode) for matchmode in STATS_MATCHMODES for gamemode in STATS_GAMEMODES]
+        payloads, stale_age = await stream_stats_report(processing_msg, uid, parts, refresh=refresh, priority=priority_for(event))
+        await edit_message(processing_msg, stats_report_text(uid, parts, payloads, stale_age))
         
     except Exception as e:
-        logging.error("Player Stats Command Error: {}".format(e))
-        await event.reply("```\n❌ Error: {}\n```".format(str(e)))
+        logging.error("Player Stats All Command Error: {}".format(e))
+        await send_reply(event, "```\n❌ Error: {}\n```".format(str(e)))
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.ps$'))
+@command("ps", r'(?i)^\.ps$')
 async def player_stats_help(event):
     """Show help for .ps command when used without arguments"""
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
-        return
-    
     help_lines = []
     help_lines.append("```")
     help_lines.append("📊 Player Stats Command Usage")
@@ -737,30 +2899,211 @@ async def player_stats_help(event):
     help_lines.append("  .ps 1710824990 CAREER br")
     help_lines.append("  .ps 1710824990 RANKED cs")
     help_lines.append("  .ps 1710824990 NORMAL br")
+    help_lines.append("")
+    help_lines.append("📋 ALL MODES AT ONCE:")
+    help_lines.append("  .ps 1710824990 ALL")
+    help_lines.append("")
+    help_lines.append("🔎 DETAIL PAGES:")
+    help_lines.append("  Reply .solo .duo .squad .cs or .refresh to a result")
     help_lines.append("```")
-    await event.reply("\n".join(help_lines))
+    await send_reply(event, "\n".join(help_lines))
 
-# ================ CALCULATOR COMMAND (FIXED WITH PROPER %) ================
+# ================ STATS DETAIL PAGES ================
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.c\s+(.+)$'))
-async def calculator_command(event):
-    """Calculator command - .c (expression)"""
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
+STATS_VIEW_MAX = 500  # .ps summaries whose detail pages can still be opened by reply
+STATS_PAGE_HINT = "💡 Reply .solo .duo .squad .cs or .refresh for details"
+
+# (chat_id, message id) -> (message, uid, matchmode, gamemode) of a .ps summary
+stats_views = OrderedDict()
+
+# Detail page for a single BR mode (solo / duo / squad)
+render_br_mode_page = {
+    name: compile_report(
+        "page:" + name,
+        stats_header("🎮 FREE FIRE BATTLE ROYALE STATS", "Battle Royale") + br_mode_section(name, field_name, title, team) + ("",) + STATS_FOOTER
+    )
+    for name, field_name, label, title, team in BR_MODES
+}
+
+def stats_summary_text(uid, matchmode, gamemode, payloads, stale_age):
+    """The .ps summary: the streamed report plus how to open its detail pages"""
+    parts = [(matchmode, gamemode)]
+    text = stats_report_text(uid, parts, payloads, stale_age)
+    data = payloads.get(parts[0])
+    if not BOT_ACCOUNT and data is not None and not is_stats_missing(data):
+        text += "\n" + STATS_PAGE_HINT
+    return text
+
+def stats_page_text(data, stale_age, uid, matchmode, gamemode, page):
+    """Render one .ps detail page ("solo", "duo", "squad" or "cs") from a stats payload"""
+    if page == "cs":
+        text = format_cs_stats(data, matchmode, uid)
+    else:
+        text = render_cache.render("page:" + page, render_br_mode_page[page], data, {"uid": uid, "matchmode": matchmode})
+    if stale_age is not None:
+        text += "\n" + stale_marker(stale_age)
+    return text
+
+def page_gamemode(page, gamemode):
+    """Gamemode whose payload a page is drawn from; the summary keeps the view's own"""
+    if page in ("solo", "duo", "squad"):
+        return "br"
+    if page == "cs":
+        return "cs"
+    return gamemode
+
+def page_needs_fetch(uid, matchmode, gamemode, page, refresh=False):
+    """True when opening `page` would wait on the upstream instead of being served from memory"""
+    if refresh:
+        return True
+    entry = player_cache.peek(stats_cache_key(uid, matchmode, page_gamemode(page, gamemode)))
+    if entry is None or entry.fresh:
+        return entry is None
+    return is_stats_missing(entry.value) or entry.age >= entry.ttl + STALE_WHILE_REVALIDATE
+
+async def load_stats_page(uid, matchmode, gamemode, page, refresh=False, priority=PRIORITY_USER):
+    """
+    Text for one .ps page. Pages are drawn from the cached payload, so
+    switching between them normally costs no upstream call.
+    """
+    if page == "summary":
+        data, stale_age = await fetch_player_stats(uid, matchmode, gamemode, refresh=refresh, priority=priority)
+        payloads = {"profile": cached_profile(uid), (matchmode, gamemode): data}
+        return stats_summary_text(uid, matchmode, gamemode, payloads, stale_age)
+    
+    gamemode = page_gamemode(page, gamemode)
+    data, stale_age = await fetch_player_stats(uid, matchmode, gamemode, refresh=refresh, priority=priority)
+    if data is None:
+        return "```\n❌ Error: Unable to fetch data from API.\nPlease try again later.\n```"
+    if is_stats_missing(data):
+        return "```\n❌ Error: API returned failure.\nUID: {}\nPlease check if the UID is correct.\n```".format(uid)
+    return stats_page_text(data, stale_age, uid, matchmode, gamemode, page)
+
+def stats_buttons(uid, matchmode, gamemode):
+    """Inline keyboard for a .ps summary; the whole view state rides in the callback data"""
+    if not BOT_ACCOUNT:
+        return None
+    
+    def data(page):
+        return "ps:{}:{}:{}:{}".format(page, uid, matchmode, gamemode).encode()
+    
+    return [
+        [Button.inline("👤 Solo", data("solo")), Button.inline("👥 Duo", data("duo")), Button.inline("👨‍👩‍👧‍👦 Squad", data("squad"))],
+        [Button.inline("⚔️ CS", data("cs")), Button.inline("🔄 Refresh", data("summary"))],
+    ]
+
+def remember_stats_view(message, uid, matchmode, gamemode):
+    key = (message.chat_id, message.id)
+    stats_views[key] = (message, uid, matchmode, gamemode)
+    stats_views.move_to_end(key)
+    while len(stats_views) > STATS_VIEW_MAX:
+        stats_views.popitem(last=False)
+
+STATS_PAGE_PATTERN = r'(?i)^\.(solo|duo|squad|cs|refresh)$'
+
+# Not upstream=True: flipping between cached pages must not spend a rate-limit
+# token or take the latest-wins slot of the user's own in-flight .ps
+@command("solo", STATS_PAGE_PATTERN)
+@command("duo", STATS_PAGE_PATTERN)
+@command("squad", STATS_PAGE_PATTERN)
+@command("cs", STATS_PAGE_PATTERN)
+@command("refresh", STATS_PAGE_PATTERN)
+async def stats_page_command(event):
+    """Switch a .ps summary to another page - reply .solo/.duo/.squad/.cs/.refresh to it"""
+    try:
+        page = event.pattern_match.group(1).lower()
+        view = stats_views.get((event.chat_id, event.reply_to_msg_id)) if event.is_reply else None
+        if view is None:
+            await send_reply(event, "```\n❌ Reply to a .ps result to use .{}\n\nExample: .ps 1710824990 CAREER br\n```".format(page))
+            return
+        
+        message, uid, matchmode, gamemode = view
+        # .refresh goes back to the summary; only the owner bypasses the cache
+        refresh = page == "refresh" and event.sender_id == OWNER_ID
+        page = "summary" if page == "refresh" else page
+        if (page_needs_fetch(uid, matchmode, gamemode, page, refresh)
+                and not await rate_limiter.acquire(event.sender_id, event.chat_id, event.sender_id == OWNER_ID)):
+            await send_reply(event, "```\n⏳ Slow down! Too many requests right now.\nPlease try again in a few seconds.\n```")
+            return
+        text = await load_stats_page(uid, matchmode, gamemode, page, refresh=refresh, priority=priority_for(event))
+        await edit_message(message, text)
+        
+    except Exception as e:
+        logging.error("Stats Page Command Error: {}".format(e))
+        await send_reply(event, "```\n❌ Error: {}\n```".format(str(e)))
+
+@client.on(events.CallbackQuery(pattern=rb'^ps:'))
+async def stats_page_callback(event):
+    """Inline-button version of the .ps pages (bot accounts only)"""
+    if not is_authorized(event):
+        await event.answer("❌ Not authorized")
         return
     
+    try:
+        page, uid, matchmode, gamemode = event.data.decode().split(":")[1:]
+        refresh = page == "summary" and event.sender_id == OWNER_ID
+        # Only pages that need an upstream call are rate limited
+        if (page_needs_fetch(uid, matchmode, gamemode, page, refresh)
+                and not await rate_limiter.acquire(event.sender_id, event.chat_id, event.sender_id == OWNER_ID)):
+            await event.answer("⏳ Slow down! Too many requests right now.", alert=True)
+            return
+        await event.answer()
+        
+        text = await load_stats_page(uid, matchmode, gamemode, page, refresh=refresh, priority=priority_for(event))
+        message = await event.get_message()
+        await edit_message(message, text, buttons=stats_buttons(uid, matchmode, gamemode))
+        
+    except Exception as e:
+        logging.error("Stats Page Callback Error: {}".format(e))
+
+# ================ CALCULATOR COMMAND (FIXED WITH PROPER %) ================
+
+def format_calc_table(expressions, rows):
+    """One aligned result table for a multi-line .c"""
+    number_width = len("#{}".format(len(rows)))
+    expression_width = min(max(len(expression) for expression in expressions), 24)
+    result_width = max((len(result) for result, error in rows if result is not None), default=0)
+    
+    lines = []
+    lines.append("```")
+    lines.append("❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀")
+    lines.append("🔢 𝗕𝗮𝘁𝗰𝗵 𝗖𝗮𝗹𝗰𝘂𝗹𝗮𝘁𝗶𝗼𝗻")
+    lines.append("━━━━━━━━━━━━━━━━━━")
+    for index, (expression, (result, error)) in enumerate(zip(expressions, rows), 1):
+        lines.append("{:<{}} {:<{}} = {}".format(
+            "#{}".format(index), number_width, expression, expression_width,
+            "{:>{}}".format(result, result_width) if error is None else "❌ " + error
+        ))
+    lines.append("━━━━━━━━━━━━━━━━━━")
+    lines.append("🏷️ 𝗕𝗿𝗮𝗻𝗱     : 𝗨𝗻𝗶𝗩𝗲𝗿𝘀𝗲𝗹 𝗦𝘁𝗼𝗿𝗲")
+    lines.append("❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀")
+    lines.append("```")
+    return "\n".join(lines)
+
+@command("c", r'(?is)^\.c\s+(.+)$')
+async def calculator_command(event):
+    """Calculator command - .c (expression), or one expression per line"""
     try:
         expression = event.pattern_match.group(1).strip()
         
+        # Several lines: evaluate them all and answer with a single table
+        expressions = [line.strip() for line in expression.splitlines() if line.strip()]
+        if len(expressions) > 1:
+            if len(expressions) > CALC_MAX_LINES:
+                await send_reply(event, "```\n❌ Too many lines! Max {} per message, got {}.\n```".format(CALC_MAX_LINES, len(expressions)))
+                return
+            await send_reply(event, format_calc_table(expressions, calculate_lines(expressions)))
+            return
+        
         # Security: Only allow numbers, operators, parentheses, decimal points, %, and spaces
         allowed_chars = set('0123456789+-*/().% ')
         if not all(char in allowed_chars for char in expression):
-            await event.reply("```\n❌ Invalid characters in expression!\n\nAllowed: Numbers, +, -, *, /, (, ), ., %\n\nExample: .c 120+22\n```")
+            await send_reply(event, "```\n❌ Invalid characters in expression!\n\nAllowed: Numbers, +, -, *, /, (, ), ., %\n\nExample: .c 120+22\n```")
             return
         
         # Prevent empty expression
         if not expression or expression.isspace():
-            await event.reply("```\n❌ Empty expression!\n\nExample: .c 120+22\n```")
+            await send_reply(event, "```\n❌ Empty expression!\n\nExample: .c 120+22\n```")
             return
         
         # Store original expression for display
@@ -783,25 +3126,37 @@ async def calculator_command(event):
         lines.append("❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀❀")
         lines.append("```")
         
-        await event.reply("\n".join(lines))
+        await send_reply(event, "\n".join(lines))
         
     except ZeroDivisionError:
-        await event.reply("```\n❌ Error: Division by zero!\n```")
+        await send_reply(event, "```\n❌ Error: Division by zero!\n```")
     except ValueError as ve:
-        await event.reply("```\n❌ Error: {}\n\nExample: .c 120+22\n```".format(str(ve)))
-    except SyntaxError:
-        await event.reply("```\n❌ Error: Invalid expression syntax!\n\nExample: .c 120+22\n```")
+        await send_reply(event, "```\n❌ Error: {}\n\nExample: .c 120+22\n```".format(str(ve)))
     except Exception as e:
         logging.error("Calculator Command Error: {}".format(e))
-        await event.reply("```\n❌ Error: {}\n```".format(str(e)))
+        await send_reply(event, "```\n❌ Error: {}\n```".format(str(e)))
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.c$'))
+# (expression, displayed result) - shown in the help and must stay true
+CALC_EXAMPLES = (
+    ("120+22", "142"),
+    ("100-50", "50"),
+    ("25*4", "100"),
+    ("100/5", "20"),
+    ("100+10%", "110"),
+    ("100-10%", "90"),
+    ("100*10%", "10"),
+    ("100/10%", "1,000"),
+    ("200+25%", "250"),
+    ("500-20%", "400"),
+    ("100+10%*2", "120"),
+    ("100+10%+10%", "121"),
+    ("(10+5)*2", "30"),
+    ("2.5*4", "10"),
+)
+
+@command("c", r'(?i)^\.c$')
 async def calculator_help(event):
     """Show help for .c command when used without arguments"""
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
-        return
-    
     help_lines = []
     help_lines.append("```")
     help_lines.append("🧮 Calculator Command Usage")
@@ -822,32 +3177,25 @@ async def calculator_help(event):
     help_lines.append("  • A - B% = A - (A × B ÷ 100)")
     help_lines.append("  • A * B% = A × (B ÷ 100)")
     help_lines.append("  • A / B% = A ÷ (B ÷ 100)")
+    help_lines.append("  • A + B% × C = A + (A × B ÷ 100) × C")
+    help_lines.append("  • A is everything to the left: 100+10%+10% = 121")
     help_lines.append("")
     help_lines.append("📝 EXAMPLES:")
-    help_lines.append("  .c 120+22         → 142")
-    help_lines.append("  .c 100-50         → 50")
-    help_lines.append("  .c 25*4           → 100")
-    help_lines.append("  .c 100/5          → 20")
-    help_lines.append("  .c 100+10%        → 110")
-    help_lines.append("  .c 100-10%        → 90")
-    help_lines.append("  .c 100*10%        → 10")
-    help_lines.append("  .c 100/10%        → 1,000")
-    help_lines.append("  .c 200+25%        → 250")
-    help_lines.append("  .c 500-20%        → 400")
-    help_lines.append("  .c (10+5)*2       → 30")
-    help_lines.append("  .c 2.5*4          → 10")
+    for expression, result in CALC_EXAMPLES:
+        help_lines.append("  .c {:<15}→ {}".format(expression, result))
+    help_lines.append("")
+    help_lines.append("📑 SEVERAL LINES AT ONCE:")
+    help_lines.append("  .c 500+10%")
+    help_lines.append("  ans*3              (ans = previous result)")
+    help_lines.append("  #1+#2              (#n = result of line n)")
     help_lines.append("```")
-    await event.reply("\n".join(help_lines))
+    await send_reply(event, "\n".join(help_lines))
 
 # ================ EXISTING COMMANDS CONTINUED ================
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.cd$'))
+@command("cd", r'(?i)^\.cd$')
 async def chatid_command(event):
     """Get chat ID or user details"""
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
-        return
-    
     try:
         chat = await event.get_chat()
         
@@ -871,7 +3219,7 @@ async def chatid_command(event):
             lines.append("📵 Scam: {}".format("Yes" if getattr(user, 'scam', False) else "No"))
             lines.append("```")
             
-            await event.reply("\n".join(lines))
+            await send_reply(event, "\n".join(lines))
         else:
             # It's a group or channel
             lines = []
@@ -900,26 +3248,120 @@ async def chatid_command(event):
             
             lines.append("```")
             
-            await event.reply("\n".join(lines))
+            await send_reply(event, "\n".join(lines))
         
     except Exception as e:
         logging.error("Chat ID Command Error: {}".format(e))
-        await event.reply("```\nError: {}\n```".format(str(e)))
+        await send_reply(event, "```\nError: {}\n```".format(str(e)))
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.ping$'))
+@command("ping", r'(?i)^\.ping$')
 async def ping_command(event):
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
-        return
+    await send_reply(event, "```\n🏓 Pong! Bot is alive!Currently running on 0.1Cpu and 512mb ram!Super fast!!\n```")
+
+@command("api", r'(?i)^\.api$', owner_only=True)
+async def api_status_command(event):
+    """Owner only: upstream breaker, cache and coalescing diagnostics"""
+    lines = []
+    lines.append("```")
+    lines.append("🩺 Upstream Diagnostics")
+    lines.append("═══════════════════════════════")
+    for upstream in upstream_pool:
+        for breaker in upstream.breakers.values():
+            lines.extend(breaker.describe())
+    if UPSTREAM_HEDGE:
+        lines.append("🏁 Hedged {} | hedge won {}".format(hedge_stats["hedged"], hedge_stats["hedge_wins"]))
+    lines.append("")
+    lines.append("🗃️ Memory cache: {} entries".format(len(player_cache)))
+    lines.append("  hit {} | stale {} | miss {} | evicted {}".format(
+        player_cache.hits, player_cache.stale_hits, player_cache.misses, player_cache.evictions
+    ))
+    if disk_cache is not None:
+        lines.append("💾 Disk cache: hit {} | miss {} | evicted {}".format(
+            disk_cache.hits, disk_cache.misses, disk_cache.evictions
+        ))
+    lines.append("🖨️ Render cache: hit {} | miss {} | size {}".format(
+        render_cache.hits, render_cache.misses, len(render_cache.entries)
+    ))
+    lines.append("🔗 Upstream calls {} | coalesced {} | abandoned {} | in flight {}".format(
+        single_flight_stats["started"], single_flight_stats["coalesced"],
+        single_flight_stats["abandoned"], len(inflight_requests)
+    ))
+    lines.append("⏹️ Cancelled commands: superseded {} | deleted {}".format(
+        cancel_stats["superseded"], cancel_stats["deleted"]
+    ))
+    lines.append(upstream_scheduler.describe())
+    lines.append(rate_limiter.describe())
+    lines.append(outbound_scheduler.describe())
+    if PREFETCH_STATS:
+        started = prefetch_stats["started"]
+        hit_rate = prefetch_stats["hits"] / started if started else 0
+        lines.append("🔮 Prefetch {} | used {} ({:.0%}) | skipped {}".format(
+            started, prefetch_stats["hits"], hit_rate, prefetch_stats["skipped"]
+        ))
+    lines.append("```")
+    await send_reply(event, "\n".join(lines))
+
+@command("lag", r'(?i)^\.lag$', owner_only=True)
+async def lag_command(event):
+    """Owner only: event-loop lag and the handlers that stalled the loop"""
+    lines = []
+    lines.append("```")
+    lines.append("🐢 Event Loop Lag")
+    lines.append("═══════════════════════════════")
+    lines.extend(loop_watchdog.describe())
+    lines.append("```")
+    await send_reply(event, "\n".join(lines))
+
+@command("acl", r'(?i)^\.acl(?:\s+(reload|add|del)(?:\s+(user|group)(?:\s+(-?\d+))?)?)?$', owner_only=True)
+async def acl_command(event):
+    """Owner only: show, reload or edit the authorized users/groups without a restart"""
+    global authorized_user_ids, authorized_group_ids
     
-    await event.reply("```\n🏓 Pong! Bot is alive!Currently running on 0.1Cpu and 512mb ram!Super fast!!\n```")
+    try:
+        action = (event.pattern_match.group(1) or "").lower()
+        kind = (event.pattern_match.group(2) or "").lower()
+        target = event.pattern_match.group(3)
+        note = None
+        
+        if action == "reload":
+            reload_acl()
+            note = "🔄 Reloaded from {}".format(ACL_FILE if ACL_FILE and os.path.exists(ACL_FILE) else "environment")
+        elif action:
+            if not kind or (kind == "user" and target is None):
+                await send_reply(event, "```\n❌ Usage: .acl add|del user <id>\n           .acl add|del group [chat id]\n```")
+                return
+            # ".acl add group" without an ID means the current chat
+            target_id = int(target) if target is not None else event.chat_id
+            current = authorized_user_ids if kind == "user" else authorized_group_ids
+            updated = current | {target_id} if action == "add" else current - {target_id}
+            if kind == "user":
+                authorized_user_ids = updated
+            else:
+                authorized_group_ids = updated
+            saved = save_acl()
+            note = "{} {} {}{}".format(
+                "✅ Added" if action == "add" else "🗑️ Removed", kind, target_id,
+                "" if saved else " (not persisted - set ACL_FILE)"
+            )
+        
+        lines = []
+        lines.append("```")
+        lines.append("🔐 Access Control List")
+        lines.append("═══════════════════════════════")
+        if note:
+            lines.append(note)
+            lines.append("")
+        lines.append("👤 Users ({}): {}".format(len(authorized_user_ids), ", ".join(str(uid) for uid in sorted(authorized_user_ids)) or "None"))
+        lines.append("💬 Groups ({}): {}".format(len(authorized_group_ids), ", ".join(str(gid) for gid in sorted(authorized_group_ids)) or "None"))
+        lines.append("```")
+        await send_reply(event, "\n".join(lines))
+        
+    except Exception as e:
+        logging.error("ACL Command Error: {}".format(e))
+        await send_reply(event, "```\n❌ Error: {}\n```".format(str(e)))
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.pay$'))
+@command("pay", r'(?i)^\.pay$')
 async def pay_command(event):
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
-        return
-    
     lines = []
     lines.append("**𝐔𝐍𝐈𝐕𝐄𝐑𝐒𝐄𝐋 𝐒𝐓𝐎𝐑𝐄**")
     lines.append("💸 𝐒𝐞𝐧𝐝 𝐌𝐨𝐧𝐞𝐲 / 𝐂𝐚𝐬𝐡 𝐈𝐧 𝐎𝐩𝐭𝐢𝐨𝐧𝐬")
@@ -946,14 +3388,10 @@ async def pay_command(event):
     lines.append("📷Please send screenshot or the last 3 digits after making the payment✅")
     lines.append("```")
     
-    await event.reply("\n".join(lines))
+    await send_reply(event, "\n".join(lines))
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.rcv$'))
+@command("rcv", r'(?i)^\.rcv$')
 async def rcv_command(event):
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
-        return
-    
     lines = []
     lines.append("**ദ്ദി (｡•̀ ,<)**")
     lines.append("✅𝐏𝐚𝐲𝐦𝐞𝐧𝐭 𝐑𝐞𝐜𝐞𝐢𝐯𝐞𝐝✅")
@@ -966,14 +3404,10 @@ async def rcv_command(event):
     lines.append("📦 __Please wait for a moment__")
     lines.append("🔐 __𝟏𝟎𝟎% safe and reliable service__✅")
     
-    await event.reply("\n".join(lines))
+    await send_reply(event, "\n".join(lines))
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.done$'))
+@command("done", r'(?i)^\.done$')
 async def done_command(event):
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
-        return
-    
     lines = []
     lines.append("✅ 𝗢𝗿𝗱𝗲𝗿 𝗖𝗼𝗺𝗽𝗹𝗲𝘁𝗲𝗱 ✅")
     lines.append("🎉 𝑨𝒍𝒉𝒂𝒎𝒅𝒖𝒍𝒊𝒍𝒍𝒂𝒉! অর্ডার সফলভাবে সম্পন্ন হয়েছে")
@@ -984,14 +3418,10 @@ async def done_command(event):
     lines.append("🎁 আবার অর্ডার করুন — এক্সক্লুসিভ চমক অপেক্ষায়!")
     lines.append("🛒 Stay with us & keep shopping smartly!")
     
-    await event.reply("\n".join(lines))
+    await send_reply(event, "\n".join(lines))
 
-@client.on(events.NewMessage(pattern=r'(?i)^\.help$'))
+@command("help", r'(?i)^\.help$')
 async def help_command(event):
-    # Check authorization - silently ignore if not authorized
-    if not await is_authorized(event):
-        return
-    
     help_lines = []
     help_lines.append("```")
     help_lines.append("🤖 Free Fire Userbot Commands")
@@ -1000,6 +3430,7 @@ async def help_command(event):
     help_lines.append(".Cid [UID]")
     help_lines.append("  → Get Free Fire player profile")
     help_lines.append("  → Example: .Cid 2716319203")
+    help_lines.append("  → Many UIDs (spaces/commas/new lines) → summary table")
     help_lines.append("")
     help_lines.append(".ps [UID] [MATCHMODE] [GAMEMODE]")
     help_lines.append("  → Get player statistics")
@@ -1007,6 +3438,22 @@ async def help_command(event):
     help_lines.append("  → Game Modes: br (Battle Royale), cs (Clash Squad)")
     help_lines.append("  → Example: .ps 1710824990 CAREER br")
     help_lines.append("  → Example: .ps 1710824990 RANKED cs")
+    help_lines.append("  → All modes: .ps 1710824990 ALL")
+    help_lines.append("")
+    help_lines.append(".solo / .duo / .squad / .cs / .refresh")
+    help_lines.append("  → Reply to a .ps result to open that page")
+    help_lines.append("")
+    help_lines.append(".Cid! / .ps!")
+    help_lines.append("  → Owner only: skip the cache and refetch")
+    help_lines.append("")
+    help_lines.append(".api")
+    help_lines.append("  → Owner only: upstream and cache diagnostics")
+    help_lines.append("")
+    help_lines.append(".lag")
+    help_lines.append("  → Owner only: event-loop stalls and what caused them")
+    help_lines.append("")
+    help_lines.append(".acl [reload | add/del user/group ID]")
+    help_lines.append("  → Owner only: view or edit who can use the bot")
     help_lines.append("")
     help_lines.append(".c [expression]")
     help_lines.append("  → Calculator for math expressions")
@@ -1014,6 +3461,7 @@ async def help_command(event):
     help_lines.append("  → Percentage: 100+10% = 110")
     help_lines.append("  → Example: .c 120+22")
     help_lines.append("  → Example: .c 100*25%")
+    help_lines.append("  → One expression per line: ans / #1 reuse results")
     help_lines.append("")
     help_lines.append(".cd")
     help_lines.append("  → Get chat/user ID details")
@@ -1024,10 +3472,298 @@ async def help_command(event):
     help_lines.append(".help")
     help_lines.append("  → Show this help message")
     help_lines.append("```")
-    await event.reply("\n".join(help_lines))
+    await send_reply(event, "\n".join(help_lines))
+
+# ================ HTTP SERVER ================
+
+# Keep-alive and health endpoints for the host, served from the bot's own event loop
+HTTP_PORT = int(os.environ.get("PORT", 5000))
+LOOP_LAG_INTERVAL = 0.5  # Seconds between loop-lag samples
+READY_MAX_LOOP_LAG = float(os.environ.get("READY_MAX_LOOP_LAG", "2"))  # Seconds of lag before /ready fails
+
+loop_lag = {"current": 0.0, "max": 0.0}
+
+async def monitor_loop_lag():
+    """Sample how late a timed sleep wakes up - time the loop spent on something else"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+        loop_lag["current"] = lag
+        loop_lag["max"] = max(loop_lag["max"], lag)
+        loop_lag_histogram.observe(lag)
+        loop_watchdog.beat()
+
+def cache_lookups():
+    yield ("memory", "hit"), player_cache.hits
+    yield ("memory", "stale"), player_cache.stale_hits
+    yield ("memory", "miss"), player_cache.misses
+    if disk_cache is not None:
+        yield ("disk", "hit"), disk_cache.hits
+        yield ("disk", "miss"), disk_cache.misses
+    yield ("render", "hit"), render_cache.hits
+    yield ("render", "miss"), render_cache.misses
+
+def cache_evictions():
+    yield ("memory",), player_cache.evictions
+    if disk_cache is not None:
+        yield ("disk",), disk_cache.evictions
+    yield ("render",), render_cache.evictions
+
+def breaker_states():
+    for upstream in upstream_pool:
+        for breaker in upstream.breakers.values():
+            yield breaker.labels, 0 if breaker.state == CircuitBreaker.CLOSED else 1
+
+# Counts the components already keep are read when scraped, not mirrored on the hot path
+metrics.collected("cache_lookups_total", "Cache lookups by cache and result", "counter",
+                  ("cache", "result"), cache_lookups)
+metrics.collected("cache_evictions_total", "Entries dropped to stay within cache size limits", "counter",
+                  ("cache",), cache_evictions)
+metrics.collected("circuit_breaker_open", "1 while an upstream endpoint breaker is open or half-open", "gauge",
+                  ("upstream", "endpoint"), breaker_states)
+metrics.collected("rate_limited_total", "Upstream-backed commands refused by the rate limiter", "counter",
+                  (), lambda: [((), rate_limiter.rejected)])
+metrics.collected("flood_waits_total", "FloodWaitError responses to sends and edits", "counter",
+                  (), lambda: [((), outbound_scheduler.flood_waits)])
+metrics.collected("flood_wait_seconds_total", "Seconds Telegram asked outbound messages to wait", "counter",
+                  (), lambda: [((), outbound_scheduler.flood_seconds)])
+metrics.collected("outbound_queue_depth", "Sends and edits waiting to go out", "gauge",
+                  (), lambda: [((), outbound_scheduler.depth())])
+metrics.collected("upstream_queue_depth", "Upstream lookups waiting for a worker", "gauge",
+                  (), lambda: [((), upstream_scheduler.queued())])
+metrics.collected("event_loop_lag_max_seconds", "Largest loop lag seen since start", "gauge",
+                  (), lambda: [((), loop_lag["max"])])
+
+async def http_home(request):
+    return web.Response(text="Free Fire Userbot is running!")
+
+async def http_health(request):
+    """Liveness: answering at all means the event loop is running"""
+    return web.json_response({"status": "alive", "loop_lag_ms": round(loop_lag["current"] * 1000, 1)})
+
+async def http_ready(request):
+    """Readiness: Telegram connected and the loop not stalled; upstream state is reported, not required"""
+    connected = OWNER_ID is not None and client.is_connected()
+    upstreams = {
+        upstream.base_url: {endpoint: breaker.state for endpoint, breaker in upstream.breakers.items()}
+        for upstream in upstream_pool
+    }
+    ready = connected and loop_lag["current"] < READY_MAX_LOOP_LAG
+    body = {
+        "status": "ready" if ready else "not ready",
+        "telegram_connected": connected,
+        "upstream_degraded": {endpoint: upstream_degraded(endpoint) for endpoint in Upstream.ENDPOINT_TIMEOUTS},
+        "upstreams": upstreams,
+        "loop_lag_ms": round(loop_lag["current"] * 1000, 1),
+        "loop_lag_max_ms": round(loop_lag["max"] * 1000, 1),
+    }
+    return web.json_response(body, status=200 if ready else 503)
+
+async def http_metrics(request):
+    """Prometheus text exposition of the metrics registry"""
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"Cache-Control": "no-store"})
+
+async def start_http_server():
+    """Start the HTTP endpoints on PORT; returns the runner to clean up on shutdown"""
+    app = web.Application()
+    app.router.add_get("/", http_home)
+    app.router.add_get("/health", http_health)
+    app.router.add_get("/ready", http_ready)
+    app.router.add_get("/metrics", http_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", HTTP_PORT).start()
+    spawn_background(monitor_loop_lag())
+    logging.info("HTTP server listening on port {}".format(HTTP_PORT))
+    return runner
+
+# ================ LOOP WATCHDOG ================
+
+# Task names asyncio gives by default; command tasks are renamed in dispatch_command
+DEFAULT_TASK_NAME = re.compile(r'Task-\d+$')
+# Pieces of an asyncio handle repr such as "<Task pending name='...' coro=<func() ...>>"
+HANDLE_TASK_NAME = re.compile(r"name='([^']*)'")
+HANDLE_CORO = re.compile(r'coro=<([\w.<>]+)\(')
+
+class LoopStall:
+    """One stretch of time the event loop spent on a single piece of work"""
+
+    __slots__ = ("at", "duration", "handler", "stack", "beat")
+
+    def __init__(self, duration, handler, stack=(), beat=None):
+        self.at = time.time()
+        self.duration = duration
+        self.handler = handler
+        self.stack = stack
+        self.beat = beat
+
+def handler_label(name, handler):
+    return "{} (.{})".format(handler.__name__, name)
+
+def task_label(task):
+    """Command tasks carry their handler name; other tasks go by their coroutine"""
+    if task is None:
+        return "(callback)"
+    name = task.get_name()
+    if not DEFAULT_TASK_NAME.match(name):
+        return name
+    return getattr(task.get_coro(), "__qualname__", name)
+
+def handle_label(description):
+    """Best name for the task or callback in one of asyncio's slow-callback warnings"""
+    name = HANDLE_TASK_NAME.search(description)
+    if name and not DEFAULT_TASK_NAME.match(name.group(1)):
+        return name.group(1)
+    coro = HANDLE_CORO.search(description)
+    if coro:
+        return coro.group(1)
+    return description[:80]
+
+class LoopWatchdog:
+    """
+    Background thread that watches the loop-lag heartbeat. When the loop has
+    not beaten for LAG_WATCHDOG_THRESHOLD it samples the loop thread's stack
+    and the task that is running, and records the stall's full length once
+    the heartbeat resumes. With ASYNCIO_DEBUG, asyncio's own slow-callback
+    warnings are kept as well.
+    """
+
+    POLL_INTERVAL = 0.1
+    STACK_DEPTH = 12
+
+    def __init__(self, threshold, history):
+        self.threshold = threshold
+        self.stalls = deque(maxlen=history)
+        self.stall_totals = {}  # handler -> [count, seconds, worst]; written by the watchdog thread only
+        self.stall_count = 0
+        self.slow_callbacks = deque(maxlen=history)
+        self.callback_totals = {}  # handler -> [count, seconds, worst]; written by the loop thread only
+        self.slow_callback_count = 0
+        self.heartbeat = time.monotonic()
+        self._loop = None
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+
+    def beat(self):
+        self.heartbeat = time.monotonic()
+
+    def start(self, loop):
+        """Start watching `loop`; must be called from the loop's own thread"""
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self.beat()
+        if ASYNCIO_DEBUG:
+            loop.set_debug(True)
+            loop.slow_callback_duration = LAG_SLOW_CALLBACK
+            logging.getLogger("asyncio").addHandler(SlowCallbackLog(self))
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self):
+        stall = None
+        while not self._stop.wait(self.POLL_INTERVAL):
+            beat = self.heartbeat
+            if stall is not None and beat != stall.beat:
+                # The late beat has arrived: the stall lasted as long as it was late
+                stall.duration = max(stall.duration, beat - stall.beat - LOOP_LAG_INTERVAL)
+                self._record(stall)
+                stall = None
+            overdue = time.monotonic() - beat - LOOP_LAG_INTERVAL
+            if stall is not None:
+                stall.duration = overdue
+            elif overdue >= self.threshold:
+                stall = self._capture(beat, overdue)
+
+    def _capture(self, beat, overdue):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        entries = traceback.extract_stack(frame) if frame is not None else []
+        # Frames from asyncio.run down to the callback being run are the same every time
+        for index in range(len(entries) - 1, -1, -1):
+            if entries[index].name == "_run" and entries[index].filename.endswith(os.path.join("asyncio", "events.py")):
+                entries = entries[index + 1:]
+                break
+        stack = [
+            "{}:{} {}".format(os.path.basename(entry.filename), entry.lineno, entry.name)
+            for entry in entries[-self.STACK_DEPTH:]
+        ]
+        handler = task_label(asyncio.current_task(self._loop))
+        logging.warning("Event loop stalled {:.2f}s so far in {}:\n  {}".format(overdue, handler, "\n  ".join(stack)))
+        return LoopStall(overdue, handler, stack, beat)
+
+    @staticmethod
+    def _add(totals, stall):
+        entry = totals.setdefault(stall.handler, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += stall.duration
+        entry[2] = max(entry[2], stall.duration)
+
+    def _record(self, stall):
+        self.stalls.append(stall)
+        self._add(self.stall_totals, stall)
+        self.stall_count += 1
+
+    def note_slow_callback(self, description, duration):
+        stall = LoopStall(duration, handle_label(description))
+        self.slow_callbacks.append(stall)
+        self._add(self.callback_totals, stall)
+        self.slow_callback_count += 1
+
+    @staticmethod
+    def _describe_totals(totals, limit=5):
+        ranked = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+        return [
+            "  {}: {} | {:.2f}s total | worst {:.2f}s".format(handler, count, seconds, worst)
+            for handler, (count, seconds, worst) in ranked[:limit]
+        ]
+
+    def describe(self):
+        lines = ["Now {:.0f} ms | max {:.2f}s | stall threshold {:.1f}s".format(
+            loop_lag["current"] * 1000, loop_lag["max"], self.threshold
+        )]
+        lines.append("")
+        lines.append("🧊 Stalls: {}".format(self.stall_count))
+        lines.extend(self._describe_totals(dict(self.stall_totals)))
+        if ASYNCIO_DEBUG:
+            lines.append("🐌 Slow callbacks (>{:.2f}s): {}".format(LAG_SLOW_CALLBACK, self.slow_callback_count))
+            lines.extend(self._describe_totals(dict(self.callback_totals)))
+        for stall in list(self.stalls)[-2:]:
+            lines.append("")
+            lines.append("{} - {:.2f}s in {}".format(
+                datetime.fromtimestamp(stall.at).strftime("%H:%M:%S"), stall.duration, stall.handler
+            ))
+            lines.extend("  " + frame for frame in stall.stack)
+        return lines
+
+class SlowCallbackLog(logging.Handler):
+    """Feeds asyncio's debug-mode "Executing ... took ..." warnings to the watchdog"""
+
+    def __init__(self, watchdog):
+        super().__init__(logging.WARNING)
+        self.watchdog = watchdog
+
+    def emit(self, record):
+        if record.msg.startswith("Executing ") and len(record.args) == 2:
+            description, duration = record.args
+            self.watchdog.note_slow_callback(str(description), duration)
+
+loop_watchdog = LoopWatchdog(LAG_WATCHDOG_THRESHOLD, LAG_HISTORY)
+
+metrics.collected("event_loop_stalls_total", "Stalls longer than LAG_WATCHDOG_THRESHOLD", "counter",
+                  (), lambda: [((), loop_watchdog.stall_count)])
+metrics.collected("event_loop_slow_callbacks_total", "Callbacks slower than LAG_SLOW_CALLBACK (ASYNCIO_DEBUG only)",
+                  "counter", (), lambda: [((), loop_watchdog.slow_callback_count)])
 
 async def main():
-    global OWNER_ID  # Declare global to modify it
+    global OWNER_ID, BOT_ACCOUNT  # Declare global to modify it
+    
+    # Up before Telegram connects, so the host sees the port open right away
+    http_runner = await start_http_server()
+    loop_watchdog.start(asyncio.get_running_loop())
     
     try:
         # Connect to Telegram
@@ -1042,12 +3778,13 @@ async def main():
         # Cache owner ID at startup (FIX #1 - only call once)
         me = await client.get_me()
         OWNER_ID = me.id
+        BOT_ACCOUNT = bool(me.bot)
         
         logging.info("Userbot started successfully!")
         logging.info("User: {} (@{})".format(me.first_name, me.username if me.username else "No username"))
         logging.info("ID: {}".format(me.id))
-        logging.info("Authorized Users: {}".format(authorized_user_ids if authorized_user_ids else "Owner only"))
-        logging.info("Authorized Groups: {}".format(authorized_group_ids if authorized_group_ids else "None"))
+        logging.info("Authorized Users: {}".format(sorted(authorized_user_ids) if authorized_user_ids else "Owner only"))
+        logging.info("Authorized Groups: {}".format(sorted(authorized_group_ids) if authorized_group_ids else "None"))
         logging.info("Ready! Commands: .Cid, .ps, .c, .cd, .ping, .help")
         
         # Keep the client running
@@ -1056,16 +3793,15 @@ async def main():
     except Exception as e:
         logging.error("Start Error: {}".format(e))
         sys.exit(1)
+    finally:
+        loop_watchdog.stop()
+        await http_runner.cleanup()
+        await close_http_session()
+        if disk_cache is not None:
+            await disk_cache.close()
 
 if __name__ == "__main__":
-    # Start Flask in a separate thread
-    flask_thread = Thread(target=run_flask)
-    flask_thread.daemon = True
-    flask_thread.start()
-    
-    logging.info("Flask started")
-    
-    # Start the Telegram client
+    # Start the Telegram client (and the HTTP endpoints in the same loop)
     try:
         asyncio.run(main())
     except KeyboardInterrupt: